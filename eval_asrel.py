@@ -1,6 +1,8 @@
 from sortedcontainers import SortedDict
 import json
 import os
+from infer_prob.compressed_io import open_text
+from infer_prob.prob_table import ProbTable, find_prob_table
 
 def _read_asrel(asrelfile):  # if as1<as2, then asrel[(as1,as2)]=rel
     asrel = SortedDict()
@@ -16,22 +18,17 @@ def _read_asrel(asrelfile):  # if as1<as2, then asrel[(as1,as2)]=rel
             asrel[(min(as1, as2), max(as1, as2))] = rel if as1 < as2 else -rel
     return asrel
 
-def _read_prob(probfile):
-    prob = SortedDict()  # [p2c,p2p,c2p]
-    corefile = probfile if isinstance(probfile, str) else probfile[0]
-
-    if not isinstance(probfile, str) and len(probfile) == 2:
-        edgefile = probfile[1]
-        with open(edgefile) as f:
-            for line in f:
-                if line and not line.startswith("#"):
-                    as1, as2, p2c, p2p, c2p = line.strip().split("|")
-                    probs = [float(p2c), float(p2p), float(c2p)]
-                    if as1 > as2:
-                        probs = [float(c2p), float(p2p), float(p2c)]
-                    prob[(min(as1, as2), max(as1, as2))] = probs
-
-    with open(corefile) as f:
+def _read_prob_file(probfile, prob):
+    bin_file = find_prob_table(probfile)
+    if bin_file:
+        for as1, as2, p2c, p2p, c2p in ProbTable(bin_file).rows():
+            as1, as2 = str(as1), str(as2)
+            if as1 <= as2:
+                prob[(as1, as2)] = [p2c, p2p, c2p]
+            else:
+                prob[(as2, as1)] = [c2p, p2p, p2c]
+        return
+    with open(probfile) as f:
         for line in f:
             if line and not line.startswith("#"):
                 as1, as2, p2c, p2p, c2p = line.strip().split("|")
@@ -40,7 +37,15 @@ def _read_prob(probfile):
                     probs = [float(c2p), float(p2p), float(p2c)]
                 prob[(min(as1, as2), max(as1, as2))] = probs
 
-    return prob
+def _read_prob(probfile):
+    prob = {}  # [p2c,p2p,c2p]
+    corefile = probfile if isinstance(probfile, str) else probfile[0]
+
+    if not isinstance(probfile, str) and len(probfile) == 2:
+        _read_prob_file(probfile[1], prob)
+    _read_prob_file(corefile, prob)
+
+    return SortedDict(prob)
 
 def comp2aspadata(asrel_file, aspa_data_file):
     provider_set = SortedDict()
@@ -131,7 +136,7 @@ def path_and_link_num(pathnum_dir):
         paths=set()
         links=set()
         num=0
-        with open(os.path.join(pathnum_dir,file),'r') as f:
+        with open_text(os.path.join(pathnum_dir,file)) as f:
             for line in f:
                 path,n=line.strip().split(' ')
                 paths.add(path)
@@ -0,0 +1,244 @@
+"""Local-search alternative to the SCIP models of asrel_solver.
+
+Every link takes one of the states below. Along a path, the links that are not
+unsat must read UP* PEER? DOWN*, which is what the path, pair and order
+constraints of the clink and elink models allow. A link and its reverse move
+together: (UNSAT, UNSAT), (PEER, PEER), (DOWN, UP) or (UP, DOWN). The clink
+objective counts unsat links; the elink model has no unsat state and maximises
+the paths that start with a peer link.
+"""
+import random
+import time
+
+UP, DOWN, PEER, UNSAT = 0, 1, 2, 3
+REL = {UP: 1, DOWN: -1, PEER: 0, UNSAT: 0}
+HINT_STATE = {1: UP, -1: DOWN, 0: PEER}
+# a link goes up or down when one end has this many times the degree of the other
+PEER_DEGREE_RATIO = 1.5
+# perturbation rounds without improvement before the search stops
+MAX_STALE_ROUNDS = 2000
+# seconds of search per model unless the solver profile sets a time limit
+TIME_LIMIT = 60
+
+
+def _valid(states, path):
+    phase = 0  # 1 after the peer link, 2 once going down
+    for i in path:
+        state = states[i]
+        if state == UP:
+            if phase:
+                return False
+        elif state == PEER:
+            if phase:
+                return False
+            phase = 1
+        elif state == DOWN:
+            phase = 2
+    return True
+
+
+def _degree_state(deg_src, deg_dst):
+    if deg_src >= PEER_DEGREE_RATIO * deg_dst:
+        return DOWN
+    if deg_dst >= PEER_DEGREE_RATIO * deg_src:
+        return UP
+    return PEER
+
+
+class _LocalSearch(object):
+    def __init__(self, kind, linknum, idxpaths, revlinks, degrees, hints, heads=None, seed=0):
+        self.kind = kind
+        self.idxpaths = idxpaths
+        if heads is None:
+            heads = [0] * linknum
+            for path in idxpaths:
+                heads[path[0]] += 1
+        self.heads = heads  # paths starting at each link, for the elink objective
+        self.rng = random.Random(seed)
+        paired = {}
+        for idx1, idx2 in revlinks:
+            paired[idx1] = idx2
+            paired[idx2] = idx1
+        self.revidx = {idx1 for idx1, _ in revlinks}
+
+        single = [(UP,), (DOWN,), (PEER,)]
+        double = [(PEER, PEER), (DOWN, UP), (UP, DOWN)]
+        if kind == "clink":
+            single.append((UNSAT,))
+            double.append((UNSAT, UNSAT))
+        self.units, self.options, self.unit_of = [], [], [0] * linknum
+        for i in range(linknum):
+            if i in paired and paired[i] < i:
+                continue
+            self.unit_of[i] = len(self.units)
+            if i in paired:
+                self.unit_of[paired[i]] = len(self.units)
+                self.units.append((i, paired[i]))
+                self.options.append(double)
+            else:
+                self.units.append((i,))
+                self.options.append(single)
+
+        self.unit_paths = [[] for _ in self.units]
+        for p, path in enumerate(idxpaths):
+            for u in {self.unit_of[i] for i in path}:
+                self.unit_paths[u].append(p)
+
+        self.states = [None] * linknum
+        self.choice = [0] * len(self.units)
+        for u, links in enumerate(self.units):
+            rel = hints[links[0]] if hints is not None else None
+            if rel is not None:
+                state = HINT_STATE[rel]
+            else:
+                state = _degree_state(*degrees[links[0]])
+            for k, option in enumerate(self.options[u]):
+                if option[0] == state:
+                    self.choice[u] = k
+            for i, state in zip(links, self.options[u][self.choice[u]]):
+                self.states[i] = state
+
+        self.valid = [_valid(self.states, path) for path in idxpaths]
+        self.violations = self.valid.count(False)
+        self.cost = self._full_cost()
+        # any violation outweighs the whole objective
+        self.penalty = len(idxpaths) + linknum + 1
+
+    def _full_cost(self):
+        if self.kind == "clink":
+            return self.states.count(UNSAT)
+        return -sum(num for i, num in enumerate(self.heads) if self.states[i] == PEER)
+
+    def score(self):
+        return self.penalty * self.violations + self.cost
+
+    def move(self, u, k):
+        """Switch unit u to option k; returns the change of the score."""
+        old = {i: self.states[i] for i in self.units[u]}
+        for i, state in zip(self.units[u], self.options[u][k]):
+            self.states[i] = state
+        self.choice[u] = k
+        cost, violations = 0, 0
+        if self.kind == "clink":
+            cost = sum(self.states[i] == UNSAT for i in old) - sum(s == UNSAT for s in old.values())
+        else:
+            cost = -sum(self.heads[i] * ((self.states[i] == PEER) - (s == PEER)) for i, s in old.items())
+        for p in self.unit_paths[u]:
+            path = self.idxpaths[p]
+            valid = _valid(self.states, path)
+            if valid != self.valid[p]:
+                self.valid[p] = valid
+                violations += -1 if valid else 1
+        self.cost += cost
+        self.violations += violations
+        return self.penalty * violations + cost
+
+    def _neighbours(self, u):
+        return {self.unit_of[i] for p in self.unit_paths[u] for i in self.idxpaths[p]}
+
+    def descend(self, units, log):
+        """First-improvement descent over single-unit moves, starting from ``units``
+        and revisiting the neighbours of every unit that changes."""
+        queue = list(units)
+        self.rng.shuffle(queue)
+        queued = set(queue)
+        while queue:
+            u = queue.pop()
+            queued.discard(u)
+            current = self.choice[u]
+            best_k, best_delta = current, 0
+            for k in range(len(self.options[u])):
+                if k == current:
+                    continue
+                delta = self.move(u, k)
+                if delta < best_delta:
+                    best_k, best_delta = k, delta
+                self.move(u, current)
+            if best_k == current:
+                continue
+            self.move(u, best_k)
+            log.append((u, current))
+            for v in self._neighbours(u):
+                if v not in queued:
+                    queued.add(v)
+                    queue.append(v)
+
+    def search(self, time_limit):
+        if not self.units:
+            return 0
+        start = time.perf_counter()
+        self.descend(range(len(self.units)), [])
+        rounds, stale = 0, 0
+        while stale < MAX_STALE_ROUNDS and time.perf_counter() - start < time_limit:
+            rounds += 1
+            before = self.score()
+            log = []
+            # kick a unit of a violated path, or any unit once all paths are valid
+            violated = [p for p, valid in enumerate(self.valid) if not valid]
+            if violated:
+                u = self.unit_of[self.rng.choice(self.idxpaths[self.rng.choice(violated)])]
+            else:
+                u = self.rng.randrange(len(self.units))
+            k = self.rng.choice([k for k in range(len(self.options[u])) if k != self.choice[u]])
+            log.append((u, self.choice[u]))
+            self.move(u, k)
+            self.descend(self._neighbours(u), log)
+            if self.score() < before:
+                stale = 0
+                continue
+            stale += 1
+            if self.score() > before:
+                for v, k in reversed(log):
+                    self.move(v, k)
+        return rounds
+
+    def repair(self):
+        """Make every violated path valid by setting its links unsat (clink
+        only); unsat links are skipped along any path, so valid paths stay valid."""
+        for p, path in enumerate(self.idxpaths):
+            if self.valid[p]:
+                continue
+            for u in {self.unit_of[i] for i in path}:
+                self.move(u, len(self.options[u]) - 1)  # the unsat option comes last
+
+    def rels(self):
+        return [None if i in self.revidx else REL[state] for i, state in enumerate(self.states)]
+
+
+def solve_heuristic(
+    kind, linknum, idxpaths, revlinks, log_path=None, degrees=None, hints=None, heads=None, time_limit=TIME_LIMIT
+):
+    """Same inputs and (rels, stats) result as the SCIP sub-problem solvers.
+
+    ``degrees`` holds the (source, destination) AS degrees of every link and
+    seeds the states where ``hints`` (prior relationships) do not. ``heads``
+    counts the paths starting at each link (default: those of ``idxpaths``).
+    Paths still violated after the search are repaired with unsat links in
+    the clink model; in the elink model, which has no unsat state, they are
+    left violated and stats["violations"] counts them, so the objective is
+    not that of a feasible solution.
+    """
+    start = time.perf_counter()
+    if degrees is None:
+        degrees = [(1, 1)] * linknum
+    search = _LocalSearch(kind, linknum, idxpaths, revlinks, degrees, hints, heads)
+    initial = (search.violations, search.cost)
+    rounds = search.search(time_limit)
+    if kind == "clink":
+        search.repair()
+    stats = {
+        "objective": float(search.cost),
+        "violations": search.violations,
+        "rounds": rounds,
+        "solving_s": time.perf_counter() - start,
+    }
+    if log_path:
+        with open(log_path, "w", encoding="utf-8") as f:
+            f.write(
+                "heuristic {}: initial {} violated paths, cost {}; after {} rounds {} violated paths, "
+                "objective {}{} in {:.2f}s\n".format(
+                    kind, initial[0], initial[1], rounds, stats["violations"], stats["objective"],
+                    " (infeasible)" if stats["violations"] else "", stats["solving_s"],
+                )
+            )
+    return search.rels(), stats
@@ -1,155 +1,450 @@
 from sortedcontainers import SortedDict, SortedSet
-from asrel_solver import ASRelSolver
-from gibbs_sampling import GibbsSampling
+from asrel_solver import ASRelSolver, SolverProfile, read_asrel
+from gibbs_sampling import GibbsSampling, read_core_paths, read_link_prob
 from p2c_edgelink import P2CEdgeLinkInfer
+from path_corpus import PathCorpus, read_path_yield
+from stage_cache import StageCache
+from component_cache import ComponentCache
+from stage_metrics import StageMetrics
+from path_sanitizer import sanitize_corpus
+from external_sort import aggregate_counts
+from prob_table import binary_path, write_prob_table
 import os
 import argparse
 import time
+import json
+import numpy as np
 
 
 class ASRelProb(object):
-    def __init__(self, pathnumfile, clinkfile, elinkfile,log_dir) -> None:
+    def __init__(
+        self, pathnumfile, clinkfile, elinkfile, log_dir, cache=None, gibbs_iter=1000, memory_budget=None,
+        metrics=None, solver_workers=1, reduce_model=False, check_reduction=False,
+        prior_clinkfile=None, solver="scip", model_builder="api", solver_profile=None,
+        component_cache=None, gibbs_engine="array", gibbs_seed=None, gibbs_workers=1,
+        gibbs_chains=1, gibbs_rhat=1.05, gibbs_min_ess=100, gibbs_estimator="counts",
+        gibbs_adaptive=False, gibbs_patience=10, prior_probfile=None, prior_corepathfile=None, gibbs_hops=1,
+        gibbs_checkpoint_every=100,
+    ) -> None:
 
-        self.corepaths = None
         self.elinks = SortedDict()
         self.clinks = None
+        self.corpus = None
+        self.core_corpus = None
 
         self.pathnumfile = pathnumfile
         self.clinkfile = clinkfile
         self.elinkfile = elinkfile
         self.log_dir=log_dir
+        self.gibbs_iter = gibbs_iter
+        # "array" samples over integer context arrays, "dict" is the original sampler
+        self.gibbs_engine = gibbs_engine
+        self.gibbs_seed = gibbs_seed
+        # processes sharing each colour of the "chromatic" engine
+        self.gibbs_workers = gibbs_workers
+        # with several chains, gibbs_iter is the most sweeps per chain before giving up on convergence
+        self.gibbs_chains = gibbs_chains
+        self.gibbs_rhat = gibbs_rhat
+        self.gibbs_min_ess = gibbs_min_ess
+        # "counts" of sampled states or "rao_blackwell" averages of conditional distributions
+        self.gibbs_estimator = gibbs_estimator
+        # retire links deterministic for gibbs_patience sweeps; draws the same samples, so not a cache param
+        self.gibbs_adaptive = gibbs_adaptive
+        self.gibbs_patience = gibbs_patience
+        # core_link.txt and corepath.txt of an earlier run: only links whose contexts changed, and those
+        # within gibbs_hops of them, are resampled, the others keep their probabilities
+        self.prior_probfile = prior_probfile
+        self.prior_corepathfile = prior_corepathfile
+        self.gibbs_hops = gibbs_hops
+        # sweeps between checkpoints of the Gibbs sampler in log_dir, which a rerun resumes from; 0 disables them
+        self.gibbs_checkpoint_every = gibbs_checkpoint_every
+        self.memory_budget = memory_budget  # bytes for core-path aggregation, None keeps it in memory
+        # processes solving independent components of the ILPs; 1 solves one monolithic model
+        self.solver_workers = solver_workers
+        # prune implied ordering constraints of the clink ILP; optionally re-solve the full model to compare
+        self.reduce_model = reduce_model
+        self.check_reduction = check_reduction
+        # as1|as2|rel file of an earlier run (e.g. last month's init_core_link) to warm-start the clink ILP
+        self.prior_clinkfile = prior_clinkfile
+        # "scip" solves the ILPs exactly, "heuristic" runs the asrel_heuristic local search
+        self.solver = solver
+        # "api" builds the SCIP models call by call, "lp" streams them to an LP file SCIP reads at once
+        self.model_builder = model_builder
+        # SCIP threads, time and memory limits, heuristic emphasis and incumbent dumps
+        self.solver_profile = solver_profile or SolverProfile()
+        # ComponentCache of ILP components solved by earlier runs, None solves every component
+        self.component_cache = component_cache
+
+        # with a StageCache, stage outputs are reused only when their key matches;
+        # without one, any existing output file is reused as is
+        self.cache = cache
+        self.stage_keys = {}
+        self.metrics = metrics if metrics is not None else StageMetrics()
+        # stage that produced self.corpus: "corpus", or "sanitize" once the paths are cleaned
+        self.corpus_stage = "corpus"
+
+    def _stage_key(self, stage, upstream=(), input_files=(), params=None):
+        if self.cache is not None:
+            self.stage_keys[stage] = self.cache.key(
+                stage, [self.stage_keys[u] for u in upstream], input_files, params
+            )
+
+    def _restore_stage(self, stage, files, upstream=(), input_files=(), params=None):
+        if self.cache is None:
+            return all(os.path.exists(file) for file in files)
+        self._stage_key(stage, upstream, input_files, params)
+        if self.cache.fetch(self.stage_keys[stage], files):
+            print(f"Reusing cached {stage} stage")
+            return True
+        return False
+
+    def _save_stage(self, stage, files):
+        if self.cache is not None:
+            self.cache.store(self.stage_keys[stage], stage, files)
+
+    def _profile_params(self):
+        # incumbent dumps do not change the solution, so they do not invalidate cached stages
+        params = self.solver_profile.to_dict()
+        del params["incumbent_interval"]
+        return params
+
+    def _check_solve(self, name, stats):
+        if stats.get("status") == "infeasible":
+            print(
+                "Warning: the {} heuristic left {} paths violated, so its objective {} is infeasible".format(
+                    name, stats["violations"], stats["objective"]
+                )
+            )
+        elif stats.get("status", "optimal") != "optimal":
+            gap = stats["max_gap"]
+            print(
+                "Warning: the {} ILP stopped with status {} (gap {})".format(
+                    name, stats["status"], "unknown" if gap is None else "{:.2%}".format(gap)
+                )
+            )
 
     def read_path_yield(self):  # path:tuple num:int
-        if isinstance(self.pathnumfile, list):
-            for file in self.pathnumfile:
-                with open(file, "r", encoding="utf-8") as f:
-                    for line in f:
-                        line=line.strip().split(' ')
-                        if len(line)==1:
-                            yield tuple(line[0].split("|")), 1
-                        else:
-                            p, n = line
-                            yield tuple(p.split("|")), int(n)
-        else:
-            with open(self.pathnumfile, "r", encoding="utf-8") as f:
-                for line in f:
-                    line=line.strip().split(' ')
-                    if len(line)==1:
-                        yield tuple(line[0].split("|")), 1
-                    else:
-                        p, n = line
-                        yield tuple(p.split("|")), int(n)
+        return read_path_yield(self.pathnumfile)
 
-    def get_core_path(self, corepathfile):
-        print("Processing core paths...")
-        self.corepaths = SortedDict()
-        if os.path.exists(corepathfile):
-            with open(corepathfile, "r", encoding="utf-8") as f:
-                for line in f.readlines():
-                    path, num = line.strip().split(" ")
-                    self.corepaths[tuple(path.split("|"))] = int(num)
-            return
+    def compile_corpus(self, corpus_dir, workers=1):
+        with self.metrics.stage("ingest") as m:
+            m["cached"] = self._compile_corpus(corpus_dir, workers)
+            m["paths"] = len(self.corpus)
+            m["hops"] = len(self.corpus.nodes)
+            m["asns"] = len(self.corpus.asns)
 
-        links = SortedDict()
+    def _compile_corpus(self, corpus_dir, workers):
+        pathnumfile = self.pathnumfile if isinstance(self.pathnumfile, list) else [self.pathnumfile]
+        files = PathCorpus.files(corpus_dir, sharded=workers > 1)
+        if self.cache is None:
+            # without a cache, an existing corpus is reused only if it was compiled from these inputs
+            if PathCorpus.is_current(corpus_dir, pathnumfile):
+                self.corpus = PathCorpus.load(corpus_dir)
+                return True
+        elif self._restore_stage(
+            "corpus", files, input_files=pathnumfile, params={"sharded": workers > 1}
+        ):
+            triples_file = os.path.join(corpus_dir, PathCorpus.TRIPLES)
+            if workers <= 1 and os.path.exists(triples_file):
+                os.remove(triples_file)
+            PathCorpus.write_sources(corpus_dir, pathnumfile)
+            self.corpus = PathCorpus.load(corpus_dir)
+            return True
+        print("Compiling path corpus...")
+        self.corpus = PathCorpus.compile(self.pathnumfile, corpus_dir, workers)
+        self._save_stage("corpus", files)
+        return False
 
-        def add_neighbour(last, link):
-            if last in links:
-                last_right = links[last][1]
-            else:
-                last = last[::-1]
-                last_right = links[last][0]
-            if link in links:
-                link_left = links[link][0]
+    def sanitize_corpus(self, clean_dir):
+        if self.corpus is None:
+            print("No path corpus found")
+            return
+        report_file = os.path.join(clean_dir, "sanitize_report.json")
+        files = PathCorpus.files(clean_dir) + [report_file]
+        with self.metrics.stage("sanitize") as m:
+            m["cached"] = self._restore_stage("sanitize", files, upstream=[self.corpus_stage])
+            if m["cached"]:
+                with open(report_file, "r", encoding="utf-8") as f:
+                    self.sanitize_report = json.load(f)
             else:
-                link = link[::-1]
-                link_left = links[link][1]
-            last_right.add(link)
-            link_left.add(last)
-
-        def remove_neighbour(link, idx, neighbours):
-            asn = link[idx]
-            for neighbour in neighbours:
-                if neighbour[0] == asn:
-                    links[neighbour][0].remove(link)
-                else:
-                    links[neighbour][1].remove(link)
+                print("Sanitizing paths...")
+                corpus, self.sanitize_report = sanitize_corpus(self.corpus)
+                corpus.save(clean_dir)
+                with open(report_file, "w", encoding="utf-8", newline="\n") as f:
+                    json.dump(self.sanitize_report, f, indent=4)
+                self._save_stage("sanitize", files)
+            self.corpus = PathCorpus.load(clean_dir)
+            m.update(self.sanitize_report)
+        self.corpus_stage = "sanitize"
+        report = self.sanitize_report
+        print(
+            "Sanitized paths: {} -> {} ({} prepended, {} looped, {} bogon, {} merged), links: {} -> {}".format(
+                report["paths_in"], report["paths_out"], report["prepended_paths"],
+                report["looped_paths"], report["bogon_paths"], report["merged_paths"],
+                report["links_in"], report["links_out"],
+            )
+        )
 
-        for path, _ in self.read_path_yield():
-            if len(path) <= 2:
-                continue
-            last = path[0:2]
-            if last not in links and last[::-1] not in links:
-                links[last] = [SortedSet(), SortedSet()]
-            for i in range(1, len(path) - 1):
-                link = path[i : i + 2]
-                if link not in links and link[::-1] not in links:
-                    links[link] = [SortedSet(), SortedSet()]
-                add_neighbour(last, link)
-                last = link
-        flag = True
-        while flag:
-            flag = False
-            remove_links = []
-            for link, [leftset, rightset] in links.items():
-                if len(leftset) == 0:
-                    remove_links.append(link)
-                    remove_neighbour(link, 1, rightset)
-                    flag = True
-                elif len(rightset) == 0:
-                    remove_links.append(link)
-                    remove_neighbour(link, 0, leftset)
-                    flag = True
-            for link in remove_links:
-                del links[link]
-
-        self.clinks = SortedSet()
-        for path, num in self.read_path_yield():
+    def _peel_core_links(self):
+        """Repeatedly drop links that have no neighbour link on one of their two
+        ends; what is left are the core links, returned in both orientations.
+
+        Each link a-b is stored as (min, max) with two ends: slot 0 holds the
+        neighbours at its first ASN and slot 1 those at its second one. For a
+        prepended self-link a-a the slot follows the path direction instead.
+        """
+        self.peel_rounds = []
+        self.peel_link_num = 0
+        triples = self.corpus.triple_array()
+        if len(triples) == 0:
+            return set()
+        a, b, c = triples[:, 0], triples[:, 1], triples[:, 2]
+        base = len(self.corpus.asns)
+        keys, link_ids = np.unique(
+            np.concatenate(
+                [np.minimum(a, b) * base + np.maximum(a, b), np.minimum(b, c) * base + np.maximum(b, c)]
+            ),
+            return_inverse=True,
+        )
+        self.peel_link_num = len(keys)
+        last, link = link_ids[: len(triples)], link_ids[len(triples) :]
+        # neighbour entries: end (2 * link + slot) holds the neighbour link
+        ends = np.concatenate([2 * last + (a <= b), 2 * link + (b > c)])
+        neighbours = np.concatenate([link, last])
+        entries = np.unique(ends * len(keys) + neighbours)
+        ends, neighbours = entries // len(keys), entries % len(keys)
+
+        degree = np.bincount(ends, minlength=2 * len(keys)).tolist()
+        order = np.argsort(neighbours, kind="stable")
+        holder_offsets = np.searchsorted(neighbours[order], np.arange(len(keys) + 1)).tolist()
+        holders = ends[order].tolist()
+
+        alive = [True] * len(keys)
+        queue = [l for l in range(len(keys)) if degree[2 * l] == 0 or degree[2 * l + 1] == 0]
+        for l in queue:
+            alive[l] = False
+        while queue:
+            self.peel_rounds.append(len(queue))
+            next_queue = []
+            for l in queue:
+                for end in holders[holder_offsets[l] : holder_offsets[l + 1]]:
+                    n = end >> 1
+                    if not alive[n]:
+                        continue
+                    degree[end] -= 1
+                    if degree[end] == 0:
+                        alive[n] = False
+                        next_queue.append(n)
+            queue = next_queue
+
+        links = set()
+        for key in keys[np.flatnonzero(alive)].tolist():
+            as1, as2 = divmod(key, base)
+            links.add((as1, as2))
+            links.add((as2, as1))
+        return links
+
+    def _load_core_paths(self, corepathfile):
+        # the file is in path order already, so it is interned line by line
+        self.core_corpus = PathCorpus.from_file(corepathfile)
+
+    def _iter_core_paths(self, links):
+        for path, num in self.corpus.iter_paths():
             left = -1  # first core link idx
             right = len(path) - 1  # first non-core link idx
             for i in range(len(path) - 1):
                 link = path[i : i + 2]
-                if left == -1 and (link in links or link[::-1] in links):
-                    self.clinks.add(link)
+                if left == -1 and link in links:
                     left = i
-                elif left != -1 and (link not in links and link[::-1] not in links):
+                elif left != -1 and link not in links:
                     right = i
                     break
             if left == -1:
                 continue
-            corepath = path[left : right + 1]
-            if corepath not in self.corepaths:
-                self.corepaths[corepath] = 0
-            self.corepaths[corepath] += num
+            yield path[left : right + 1], num
 
-        print("Writing core paths...")
-        out = ""
-        for corepath, num in self.corepaths.items():
-            out += "{} {}\n".format("|".join(list(corepath)), num)
-        with open(corepathfile, "w", encoding="utf-8", newline="\n") as f:
-            f.write(out)
+    def get_core_path(self, corepathfile):
+        print("Processing core paths...")
+        if self._restore_stage("corepath", [corepathfile], upstream=[self.corpus_stage]):
+            with self.metrics.stage("corepath") as m:
+                m["cached"] = True
+                self._load_core_paths(corepathfile)
+                m["core_paths"] = len(self.core_corpus)
+            return
+        if self.corpus is None:
+            self.compile_corpus(os.path.join(os.path.dirname(corepathfile), "corpus"))
+
+        with self.metrics.stage("peel") as m:
+            links = self._peel_core_links()
+            m["links"] = int(self.peel_link_num)
+            m["core_links"] = len(links) // 2
+            m["peel_rounds"] = self.peel_rounds
+        print(
+            "Peeled {} links in {} rounds, {} core links left: {}".format(
+                sum(self.peel_rounds), len(self.peel_rounds), len(links) // 2, self.peel_rounds
+            )
+        )
+
+        with self.metrics.stage("corepath") as m:
+            m["cached"] = False
+            m["paths"] = len(self.corpus)
+            if self.memory_budget:
+                # bounded memory: spill sorted runs, merge them and stream the file into a compiled corpus
+                print("Writing core paths...")
+                to_asns = self.corpus.to_asns
+                with open(corepathfile, "w", encoding="utf-8", newline="\n") as f:
+                    for corepath, num in aggregate_counts(
+                        self._iter_core_paths(links),
+                        self.memory_budget,
+                        os.path.dirname(os.path.abspath(corepathfile)),
+                    ):
+                        f.write("{} {}\n".format("|".join(to_asns(corepath)), num))
+                self._load_core_paths(corepathfile)
+            else:
+                corepaths = SortedDict()
+                for corepath, num in self._iter_core_paths(links):
+                    corepaths[corepath] = corepaths.get(corepath, 0) + num
+                # ids follow ASN string order, so corepaths is already in string order
+                self.core_corpus = PathCorpus.from_paths(corepaths, self.corpus.asns)
+
+                print("Writing core paths...")
+                with open(corepathfile, "w", encoding="utf-8", newline="\n") as f:
+                    for corepath, num in self.core_corpus.items():
+                        f.write("{} {}\n".format("|".join(corepath), num))
+            m["core_paths"] = len(self.core_corpus)
+            self._save_stage("corepath", [corepathfile])
+
+    def _gibbs_sampler(self, init_asrel, checkpoint):
+        prior = None
+        if self.prior_probfile:
+            prior = (read_core_paths(self.prior_corepathfile), read_link_prob(self.prior_probfile))
+        return GibbsSampling(
+            self.core_corpus, init_asrel, engine=self.gibbs_engine, seed=self.gibbs_seed,
+            workers=self.gibbs_workers, chains=self.gibbs_chains, rhat=self.gibbs_rhat,
+            min_ess=self.gibbs_min_ess, estimator=self.gibbs_estimator,
+            adaptive=self.gibbs_adaptive, patience=self.gibbs_patience, prior=prior, hops=self.gibbs_hops,
+            checkpoint=checkpoint, checkpoint_every=self.gibbs_checkpoint_every, init_key=self._init_key(),
+        )
+
+    def _init_key(self):
+        # how the core-link ILP solution was obtained, so that a checkpoint of a chain
+        # started from another solution is not resumed
+        prior = None
+        if self.prior_clinkfile:
+            stat = os.stat(self.prior_clinkfile)
+            prior = [os.path.abspath(self.prior_clinkfile), stat.st_size, stat.st_mtime_ns]
+        return dict(self._solver_params(), reduce_model=self.reduce_model, prior_core_link=prior)
 
     def infer_core_links(self):
-        if self.corepaths is None:
+        if self.core_corpus is None:
             print("No core paths found")
             return
-        if os.path.exists(self.clinkfile):
-            self.clinks = SortedDict()
-            with open(self.clinkfile, "r", encoding="utf-8") as f:
-                for line in f.readlines():
-                    as1, as2, p1, p2, p3 = line.strip().split("|")
-                    self.clinks[(as1, as2)] = [float(p1), float(p2), float(p3)]
+        init_clinkfile = self.clinkfile.replace('core_link','init_core_link.txt')
+        if self._restore_stage(
+            "clink",
+            [self.clinkfile, init_clinkfile],
+            upstream=["corepath"],
+            input_files=[f for f in (self.prior_clinkfile, self.prior_probfile, self.prior_corepathfile) if f],
+            params={
+                "gibbs_iter": self.gibbs_iter,
+                "gibbs_engine": self.gibbs_engine,
+                "gibbs_seed": self.gibbs_seed,
+                "gibbs_workers": self.gibbs_workers if self.gibbs_engine == "chromatic" else 1,
+                "gibbs_chains": self.gibbs_chains,
+                "gibbs_estimator": self.gibbs_estimator,
+                "gibbs_hops": self.gibbs_hops if self.prior_probfile else None,
+                "gibbs_convergence": [self.gibbs_rhat, self.gibbs_min_ess] if self.gibbs_chains > 1 else None,
+                "reduce_model": self.reduce_model,
+                **self._solver_params(),
+            },
+        ):
+            with self.metrics.stage("clink") as m:
+                m["cached"] = True
+                self.clinks = SortedDict()
+                with open(self.clinkfile, "r", encoding="utf-8") as f:
+                    for line in f.readlines():
+                        as1, as2, p1, p2, p3 = line.strip().split("|")
+                        self.clinks[(as1, as2)] = [float(p1), float(p2), float(p3)]
+                m["core_links"] = len(self.clinks)
             return
 
         print("Inferring core links...")
-        
-        asrel_solver = ASRelSolver(self.corepaths)
-        init_asrel = asrel_solver.solute_asrel_for_clinks(self.log_dir)
-        with open(self.clinkfile.replace('core_link','init_core_link.txt'),'w', encoding="utf-8", newline="\n") as f:
-            for link, rel in init_asrel.items():
-                f.write("{}|{}|{}\n".format(link[0], link[1], rel))
-
-        gibbs_sampling = GibbsSampling(self.corepaths, init_asrel)
-        self.clinks = gibbs_sampling.infer_asrel_prob(1000)
+
+        checkpoint = None
+        if self.gibbs_checkpoint_every and self.gibbs_engine != "dict":
+            checkpoint = os.path.join(self.log_dir, "gibbs_checkpoint.npz")
+        gibbs_sampling = None
+        if checkpoint is not None and os.path.exists(checkpoint) and os.path.exists(init_clinkfile):
+            # the checkpoint holds the sampler state, so the ILP would only be solved to be overwritten
+            with self.metrics.stage("gibbs_resume") as m:
+                gibbs_sampling = self._gibbs_sampler(read_asrel(init_clinkfile), checkpoint)
+                m["checkpoint_matches"] = gibbs_sampling.checkpoint_matches(self.gibbs_iter)
+            if m["checkpoint_matches"]:
+                print("Found a Gibbs checkpoint of this run, skipping the core-link ILP")
+            else:
+                gibbs_sampling = None
+
+        if gibbs_sampling is None:
+            with self.metrics.stage("clink_ilp") as m:
+                asrel_solver = ASRelSolver(self.core_corpus, self.solver, self.model_builder, self.solver_profile, self.component_cache)
+                prior = read_asrel(self.prior_clinkfile) if self.prior_clinkfile else None
+                init_asrel = asrel_solver.solute_asrel_for_clinks(
+                    self.log_dir, self.solver_workers, self.reduce_model, self.check_reduction, prior
+                )
+                m.update(asrel_solver.stats)
+                m["solver"] = self.solver
+                m["solver_profile"] = self.solver_profile.to_dict()
+                self._check_solve("core-link", asrel_solver.stats)
+            with open(init_clinkfile,'w', encoding="utf-8", newline="\n") as f:
+                for link, rel in init_asrel.items():
+                    f.write("{}|{}|{}\n".format(link[0], link[1], rel))
+
+        with self.metrics.stage("gibbs") as m:
+            if gibbs_sampling is None:
+                gibbs_sampling = self._gibbs_sampler(init_asrel, checkpoint)
+            self.clinks = gibbs_sampling.infer_asrel_prob(self.gibbs_iter)
+            m["core_paths"] = len(self.core_corpus)
+            m["core_links"] = len(self.clinks)
+            m["iterations"] = self.gibbs_iter
+            if gibbs_sampling.resumed_from:
+                m["resumed_from"] = gibbs_sampling.resumed_from
+                print(f"Resumed Gibbs sampling from its checkpoint at sweep {gibbs_sampling.resumed_from}")
+            if gibbs_sampling.convergence is not None:
+                m.update(gibbs_sampling.convergence)
+                report = gibbs_sampling.convergence
+                if report["converged"]:
+                    print(f"Gibbs chains converged after {report['iterations']} sweeps")
+                else:
+                    print(
+                        "Warning: {} core links had not converged after {} sweeps of {} chains, "
+                        "{} of them with the chains in different states throughout".format(
+                            report["unconverged_links"], report["iterations"], report["chains"],
+                            report["stuck_links"],
+                        )
+                    )
+            m["engine"] = self.gibbs_engine
+            m["estimator"] = self.gibbs_estimator
+            if gibbs_sampling.incremental is not None:
+                m.update(gibbs_sampling.incremental)
+                print(
+                    "Resampling {} core links whose contexts changed or are within {} hops of a change, "
+                    "carrying {} forward".format(
+                        gibbs_sampling.incremental["resampled_links"], self.gibbs_hops,
+                        gibbs_sampling.incremental["carried_links"],
+                    )
+                )
+            if self.gibbs_engine == "chromatic":
+                m["colours"] = gibbs_sampling.colour_num
+                m["workers"] = self.gibbs_workers
+            if self.gibbs_adaptive:
+                active = gibbs_sampling.active_links
+                m["active_links"] = active
+                m["mean_active_links"] = sum(active) / len(active) if active else 0
+                print(
+                    "Adaptive Gibbs sweeps resampled {:.1f} of {} core links on average, {} in the last".format(
+                        m["mean_active_links"], len(self.clinks) * max(self.gibbs_chains, 1), active[-1] if active else 0
+                    )
+                )
         print("Writing core links...")
         with open(self.clinkfile, "w", encoding="utf-8", newline="\n") as f:
             for link, prob in self.clinks.items():
@@ -158,38 +453,67 @@ class ASRelProb(object):
                         link[0], link[1], prob[0], prob[1], prob[2]
                     )
                 )
+        self._save_stage("clink", [self.clinkfile, init_clinkfile])
+
+    def _solver_params(self):
+        return {
+            "decomposed": self.solver_workers > 1,
+            "solver": self.solver,
+            "model_builder": self.model_builder,
+            "solver_profile": self._profile_params(),
+        }
 
     def infer_edge_link(self, p2c_set_file, reserved_paths_file, th):
-        if os.path.exists(self.elinkfile):
-            with open(self.elinkfile, "r", encoding="utf-8") as f:
-                for line in f.readlines():
-                    as1, as2, rel = line.strip().split("|")
-                    self.elinks[(as1, as2)] = int(rel)
-            return
         if self.clinks is None:
             print("No core links found")
             return
+        p2c_cached = self._restore_stage(
+            "p2c", [p2c_set_file, reserved_paths_file], upstream=[self.corpus_stage, "clink"], params={"th": th}
+        )
+        if p2c_cached and self._restore_stage(
+            "elink",
+            [self.elinkfile],
+            upstream=["p2c"],
+            params=self._solver_params(),
+        ):
+            with self.metrics.stage("elink") as m:
+                m["cached"] = True
+                with open(self.elinkfile, "r", encoding="utf-8") as f:
+                    for line in f.readlines():
+                        as1, as2, p1, p2, p3 = line.strip().split("|")
+                        self.elinks[(as1, as2)] = [float(p1), float(p2), float(p3)]
+                m["edge_links"] = len(self.elinks)
+            return
         print("Inferring edge links...")
         # cal p2c edge link
-        if os.path.exists(p2c_set_file) and os.path.exists(reserved_paths_file):
-            p2c_set = SortedSet()
-            with open(p2c_set_file, "r", encoding="utf-8") as f:
-                for line in f.readlines():
-                    p2c_set.add(tuple(line.strip().split("|")[:2]))
-            reserved_paths = SortedDict()
-            with open(reserved_paths_file, "r", encoding="utf-8") as f:
-                for line in f.readlines():
-                    path, num = line.strip().split(" ")
-                    reserved_paths[tuple(path.split("|"))] = int(num)
-        else:
-            p2c_edgelink_infer = P2CEdgeLinkInfer(self.pathnumfile, self.clinks)
-            p2c_set, reserved_paths = p2c_edgelink_infer.infer_p2c_edge_links(th)
-            with open(p2c_set_file, "w", encoding="utf-8", newline="\n") as f:
-                for link in p2c_set:
-                    f.write("{}|{}|-1\n".format(link[0], link[1]))
-            with open(reserved_paths_file, "w", encoding="utf-8", newline="\n") as f:
-                for path, num in reserved_paths.items():
-                    f.write("{} {}\n".format("|".join(list(path)), num))
+        if self.corpus is None and not p2c_cached:
+            self.compile_corpus(os.path.join(os.path.dirname(self.elinkfile), "corpus"))
+        with self.metrics.stage("p2c_fold") as m:
+            m["cached"] = p2c_cached
+            if p2c_cached:
+                p2c_set = SortedSet()
+                with open(p2c_set_file, "r", encoding="utf-8") as f:
+                    for line in f.readlines():
+                        p2c_set.add(tuple(line.strip().split("|")[:2]))
+                reserved_paths = SortedDict()
+                with open(reserved_paths_file, "r", encoding="utf-8") as f:
+                    for line in f.readlines():
+                        path, num = line.strip().split(" ")
+                        reserved_paths[tuple(path.split("|"))] = int(num)
+            else:
+                m["paths"] = len(self.corpus)
+                p2c_edgelink_infer = P2CEdgeLinkInfer(self.corpus, self.clinks)
+                p2c_set, reserved_paths = p2c_edgelink_infer.infer_p2c_edge_links(th)
+                with open(p2c_set_file, "w", encoding="utf-8", newline="\n") as f:
+                    for link in p2c_set:
+                        f.write("{}|{}|-1\n".format(link[0], link[1]))
+                with open(reserved_paths_file, "w", encoding="utf-8", newline="\n") as f:
+                    for path, num in reserved_paths.items():
+                        f.write("{} {}\n".format("|".join(list(path)), num))
+                self._save_stage("p2c", [p2c_set_file, reserved_paths_file])
+                self._stage_key("elink", upstream=["p2c"], params=self._solver_params())
+            m["p2c_links"] = len(p2c_set)
+            m["reserved_paths"] = len(reserved_paths)
         # cal reserved edge link
         self.elinks = SortedDict({link: [1.0,0.0,0.0] for link in p2c_set})
 
@@ -206,8 +530,14 @@ class ASRelProb(object):
         self.elinks.update({link:[1/3,1/3,1/3] for link in single_links})
         no_single_paths=[path for path in reserved_paths if path not in single_links and path[::-1] not in single_links]
         
-        asrel_solver = ASRelSolver(no_single_paths)
-        edge_link_asrel=asrel_solver.solute_asrel_for_elinks(self.log_dir)
+        with self.metrics.stage("elink_ilp") as m:
+            asrel_solver = ASRelSolver(no_single_paths, self.solver, self.model_builder, self.solver_profile, self.component_cache)
+            edge_link_asrel=asrel_solver.solute_asrel_for_elinks(self.log_dir, self.solver_workers)
+            m.update(asrel_solver.stats)
+            m["solver"] = self.solver
+            m["solver_profile"] = self.solver_profile.to_dict()
+            self._check_solve("edge-link", asrel_solver.stats)
+            m["single_links"] = len(single_links)
         
         self.elinks.update(SortedDict({link:asreltype_to_prob[rel] for link,rel in edge_link_asrel.items()}))
             
@@ -220,6 +550,7 @@ class ASRelProb(object):
             out += f"{link[0]}|{link[1]}|{prob[0]}|{prob[1]}|{prob[2]}\n"
         with open(self.elinkfile, "w", encoding="utf-8", newline="\n") as f:
             f.write(out)
+        self._save_stage("elink", [self.elinkfile])
 
 if __name__ == "__main__":
     start_time = time.time()
@@ -228,8 +559,55 @@ if __name__ == "__main__":
     parser.add_argument("--path_dir", type=str, required=True, help="Directory to as paths")
     parser.add_argument("--print_dir", type=str, required=True, help="Directory to save the output files") 
     parser.add_argument("--label", type=str, required=False, help="label")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used to ingest path_dir")
+    parser.add_argument("--sanitize", action="store_true", help="Collapse prepending and drop looped and bogon paths before inference")
+    parser.add_argument("--memory_budget", type=int, default=0, help="Memory budget in MB for core-path aggregation; 0 aggregates in memory")
+    parser.add_argument("--solver_workers", type=int, default=1, help="Processes solving independent components of the ILPs in parallel")
+    parser.add_argument("--solver", choices=["scip", "heuristic"], default="scip", help="Exact SCIP ILPs or the faster local-search heuristic")
+    parser.add_argument("--model_builder", choices=["api", "lp"], default="api", help="Build SCIP models call by call or stream them to an LP file read at once")
+    parser.add_argument("--solver_config", type=str, default=None, help="JSON file with a SCIP solver profile (threads, time_limit, memory_limit, heuristics, incumbent_interval)")
+    parser.add_argument("--solver_threads", type=int, default=None, help="Threads of SCIP's concurrent solver per model (default 1)")
+    parser.add_argument("--solver_time_limit", type=float, default=None, help="SCIP time limit in seconds per model (default 1800), or of the heuristic's search (default 60)")
+    parser.add_argument("--solver_memory_limit", type=int, default=None, help="SCIP memory limit in MB per model (default 16000)")
+    parser.add_argument("--solver_heuristics", choices=sorted(SolverProfile.HEURISTICS), default=None, help="SCIP primal heuristic emphasis of the core-link ILP (default: SCIP's)")
+    parser.add_argument("--incumbent_interval", type=float, default=None, help="Write the best SCIP solution so far next to the solver log at most every N seconds")
+    parser.add_argument("--component_cache", type=str, default=None, help="Directory of ILP components solved by earlier runs; unchanged components are not solved again")
+    parser.add_argument("--component_cache_size", type=int, default=1024, help="Component cache size limit in MB")
+    parser.add_argument("--component_cache_age", type=int, default=180, help="Drop cached components unused for this many days")
+    parser.add_argument("--reduce_model", action="store_true", help="Prune implied ordering constraints of the core-link ILP")
+    parser.add_argument("--check_reduction", action="store_true", help="With --reduce_model, also solve the full core-link ILP and fail if the objectives differ")
+    parser.add_argument("--prior_clink", type=str, default=None, help="as1|as2|rel file of an earlier run (e.g. its init_core_link.txt) used to warm-start the core-link ILP")
+    parser.add_argument("--gibbs_iter", type=int, default=1000, help="Gibbs sampling iterations for core links")
+    parser.add_argument("--gibbs_engine", choices=GibbsSampling.ENGINES, default="array", help="Gibbs sampler over integer context arrays or the original dict-based one")
+    parser.add_argument("--gibbs_workers", type=int, default=1, help="Processes sharing the sweeps of the chromatic Gibbs engine")
+    parser.add_argument("--gibbs_chains", type=int, default=1, help="Independent Gibbs chains run in parallel and stopped once converged; --gibbs_iter caps their sweeps")
+    parser.add_argument("--gibbs_rhat", type=float, default=1.05, help="Largest per-link R-hat accepted as converged with several chains")
+    parser.add_argument("--gibbs_min_ess", type=float, default=100, help="Smallest per-link effective sample size accepted as converged with several chains")
+    parser.add_argument("--gibbs_adaptive", action="store_true", help="Resample only core links whose conditional is still uncertain or whose neighbours changed (array engine)")
+    parser.add_argument("--gibbs_patience", type=int, default=10, help="Sweeps a core link's conditional must stay deterministic before --gibbs_adaptive retires it")
+    parser.add_argument("--prior_core_link", type=str, default=None, help="core_link.txt of an earlier run; with --prior_corepath, only core links whose contexts changed are resampled")
+    parser.add_argument("--prior_corepath", type=str, default=None, help="corepath.txt of the run that wrote --prior_core_link")
+    parser.add_argument("--gibbs_hops", type=int, default=1, help="With --prior_core_link, also resample core links up to this many hops from a changed one")
+    parser.add_argument("--gibbs_checkpoint_every", type=int, default=100, help="Sweeps between Gibbs sampler checkpoints that an interrupted run resumes from (0 disables them)")
+    parser.add_argument("--gibbs_estimator", choices=GibbsSampling.ESTIMATORS, default="counts", help="Core-link probabilities from sampled state counts or Rao-Blackwellised conditional distributions")
+    parser.add_argument("--gibbs_seed", type=int, default=None, help="Seed of the array Gibbs sampler (default: unseeded)")
+    parser.add_argument("--cache_dir", type=str, default=None, help="Stage cache directory (default: <print_dir>/cache)")
+    parser.add_argument("--cache_size", type=int, default=10240, help="Stage cache size limit in MB")
+    parser.add_argument("--trace_memory", action="store_true", help="Also record tracemalloc peaks per stage (slower)")
+    parser.add_argument("--no_cache", action="store_true", help="Reuse existing stage outputs without checking inputs or parameters")
     
     args = parser.parse_args()
+    if args.check_reduction and not args.reduce_model:
+        parser.error("--check_reduction needs --reduce_model")
+    if bool(args.prior_core_link) != bool(args.prior_corepath):
+        parser.error("--prior_core_link and --prior_corepath must be given together")
+    # rejected here as well as by GibbsSampling, before the core-link ILP is solved
+    if args.gibbs_engine == "dict" and (args.gibbs_chains > 1 or args.gibbs_estimator != "counts"):
+        parser.error("--gibbs_chains above 1 and --gibbs_estimator rao_blackwell need the array or chromatic engine")
+    if args.gibbs_engine == "dict" and args.prior_core_link:
+        parser.error("--prior_core_link needs the array or chromatic engine")
+    if args.gibbs_adaptive and args.gibbs_engine != "array":
+        parser.error("--gibbs_adaptive needs the array engine")
     
 
     pathnum = [os.path.join(args.path_dir, file) for file in os.listdir(args.path_dir) if os.path.isfile(os.path.join(args.path_dir, file))]
@@ -253,7 +631,56 @@ if __name__ == "__main__":
     core_link_file = os.path.join(print_dir, f"{label}_core_link.txt")
     edge_link_file = os.path.join(print_dir, f"{label}_edge_link.txt")
 
-    asrel_prob = ASRelProb(pathnum, core_link_file, edge_link_file, log_dir)
+    profile_args = {
+        "threads": args.solver_threads,
+        "time_limit": args.solver_time_limit,
+        "memory_limit": args.solver_memory_limit,
+        "heuristics": args.solver_heuristics,
+        "incumbent_interval": args.incumbent_interval,
+    }
+    if args.solver_config:
+        solver_profile = SolverProfile.load(args.solver_config, **profile_args)
+    else:
+        solver_profile = SolverProfile(**{key: value for key, value in profile_args.items() if value is not None})
+
+    cache = None
+    if not args.no_cache:
+        cache_dir = args.cache_dir if args.cache_dir else os.path.join(args.print_dir, "cache")
+        cache = StageCache(cache_dir, args.cache_size << 20)
+
+    asrel_prob = ASRelProb(
+        pathnum, core_link_file, edge_link_file, log_dir,
+        cache=cache,
+        gibbs_iter=args.gibbs_iter,
+        memory_budget=args.memory_budget << 20 if args.memory_budget else None,
+        metrics=StageMetrics(args.trace_memory),
+        solver_workers=args.solver_workers,
+        reduce_model=args.reduce_model,
+        check_reduction=args.check_reduction,
+        prior_clinkfile=args.prior_clink,
+        solver=args.solver,
+        model_builder=args.model_builder,
+        solver_profile=solver_profile,
+        component_cache=ComponentCache(
+            args.component_cache, args.component_cache_size << 20, args.component_cache_age * 86400
+        ) if args.component_cache else None,
+        gibbs_engine=args.gibbs_engine,
+        gibbs_seed=args.gibbs_seed,
+        gibbs_workers=args.gibbs_workers,
+        gibbs_chains=args.gibbs_chains,
+        gibbs_rhat=args.gibbs_rhat,
+        gibbs_min_ess=args.gibbs_min_ess,
+        gibbs_estimator=args.gibbs_estimator,
+        gibbs_adaptive=args.gibbs_adaptive,
+        gibbs_patience=args.gibbs_patience,
+        prior_probfile=args.prior_core_link,
+        prior_corepathfile=args.prior_corepath,
+        gibbs_hops=args.gibbs_hops,
+        gibbs_checkpoint_every=args.gibbs_checkpoint_every,
+    )
+    asrel_prob.compile_corpus(os.path.join(print_dir, "corpus"), args.workers)
+    if args.sanitize:
+        asrel_prob.sanitize_corpus(os.path.join(print_dir, "corpus_clean"))
     asrel_prob.get_core_path(os.path.join(print_dir, "corepath.txt"))
     asrel_prob.infer_core_links()
     asrel_prob.infer_edge_link(
@@ -273,5 +700,14 @@ if __name__ == "__main__":
             for line in edgef:
                 outfile.write(line)
     
+    if write_prob_table(probability_file) is None:
+        print("Skipping the binary probability table: found ASNs that are not 32-bit numbers")
+    else:
+        print(f"Binary probability table is saved to {binary_path(probability_file)}")
+
+    metrics_file = os.path.join(args.print_dir, f"{label}_metrics.json")
+    asrel_prob.metrics.write(metrics_file)
+    print(f"Stage metrics are saved to {metrics_file}")
+
     end_time = time.time()
     print(f"Result is saved to {probability_file} Time taken: {end_time - start_time} seconds")
\ No newline at end of file
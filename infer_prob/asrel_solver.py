@@ -1,13 +1,127 @@
 from sortedcontainers import SortedDict, SortedSet
+import json
 import os
-from pyscipopt import Model as SCIPModel, quicksum as scip_quicksum
+import shutil
+import tempfile
+import time
+from pyscipopt import (
+    Eventhdlr,
+    Model as SCIPModel,
+    SCIP_EVENTTYPE,
+    SCIP_PARAMSETTING,
+    quicksum as scip_quicksum,
+)
+from multiprocessing import Pool
+from path_corpus import PathCorpus
+from asrel_heuristic import TIME_LIMIT as HEURISTIC_TIME_LIMIT, solve_heuristic
+from component_cache import fingerprint
+
+# components smaller than this are packed together into one model
+BATCH_LINKS = 2000
+# core paths with at least this many links get prefix-chain ordering constraints
+# in the reduced clink model (6 per link instead of 2 per earlier link)
+CHAIN_MIN_LINKS = 6
+# part of every component cache key: bump it whenever the clink or elink models, or
+# how relationships are read from their solutions, change
+MODEL_VERSION = 1
+
+
+class SolverProfile(object):
+    """SCIP settings shared by every model of a run.
+
+    ``time_limit`` (s) and ``memory_limit`` (MB) default to the limits each model
+    asks for. ``threads`` > 1 runs SCIP's concurrent solver. ``heuristics`` sets
+    the primal heuristic emphasis of models that enable heuristics. With
+    ``incumbent_interval`` (s), the best solution so far is written next to the
+    solver log at most that often, and once more when the solve ends.
+    """
+
+    HEURISTICS = {
+        "default": SCIP_PARAMSETTING.DEFAULT,
+        "aggressive": SCIP_PARAMSETTING.AGGRESSIVE,
+        "fast": SCIP_PARAMSETTING.FAST,
+        "off": SCIP_PARAMSETTING.OFF,
+    }
+
+    def __init__(self, threads=1, time_limit=None, memory_limit=None, heuristics="default", incumbent_interval=None):
+        if heuristics not in self.HEURISTICS:
+            raise ValueError(f"unknown heuristic emphasis {heuristics!r}")
+        self.threads = threads
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.heuristics = heuristics
+        self.incumbent_interval = incumbent_interval
+
+    @classmethod
+    def load(cls, config_file, **overrides):
+        """Profile from a JSON object of the constructor's arguments; ``overrides`` that are not None win."""
+        with open(config_file, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        config.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**config)
+
+    def to_dict(self):
+        return {
+            "threads": self.threads,
+            "time_limit": self.time_limit,
+            "memory_limit": self.memory_limit,
+            "heuristics": self.heuristics,
+            "incumbent_interval": self.incumbent_interval,
+        }
+
+
+class _IncumbentDump(Eventhdlr):
+    # an improvement found within ``interval`` of the last write stays pending and is
+    # written by the first event after the interval, solved nodes included
+    EVENTS = (SCIP_EVENTTYPE.BESTSOLFOUND, SCIP_EVENTTYPE.NODESOLVED)
+
+    def __init__(self, solver, dump, interval):
+        self.solver = solver
+        self.dump = dump
+        self.interval = interval
+        self.last = None
+        self.pending = False
+
+    def eventinit(self):
+        for event_type in self.EVENTS:
+            self.model.catchEvent(event_type, self)
+
+    def eventexit(self):
+        for event_type in self.EVENTS:
+            self.model.dropEvent(event_type, self)
+
+    def eventexec(self, event):
+        if event.getType() == SCIP_EVENTTYPE.BESTSOLFOUND:
+            self.pending = True
+        if not self.pending:
+            return
+        now = time.perf_counter()
+        if self.last is not None and now - self.last < self.interval:
+            return
+        self.last = now
+        self.pending = False
+        sol = self.model.getBestSol()
+        self.dump(lambda var: self.solver.sol_val(sol, var))
+
 
 class _Solver:
-    def __init__(self, name: str, log_path: str = None, time_limit: int = 1800, enable_heuristics: bool = False):
+    def __init__(
+        self, name: str, log_path: str = None, time_limit: int = 1800, enable_heuristics: bool = False,
+        profile: SolverProfile = None,
+    ):
         self._log_file = None
+        self.log_path = log_path
+        self.warm_started = False
+        self.times = {}
+        self.report = {}
+        self.created = time.perf_counter()
+        self.profile = profile or SolverProfile()
+        self._dump = None
         self.m = SCIPModel(name)
-        self.m.setRealParam("limits/time", float(time_limit))
-        self.m.setParam("limits/memory", 16000)
+        self.m.setRealParam("limits/time", float(self.profile.time_limit or time_limit))
+        self.m.setParam("limits/memory", self.profile.memory_limit or 16000)
+        if enable_heuristics and self.profile.heuristics != "default":
+            self.m.setHeuristics(SolverProfile.HEURISTICS[self.profile.heuristics])
         
         self.m.setIntParam("display/verblevel", 0)
         if log_path:
@@ -23,164 +137,824 @@ class _Solver:
     def add_constr(self, expr):
         return self.m.addCons(expr)
 
+    def add_row(self, terms, sense, rhs):
+        """Add sum(coef * var for coef, var in terms) <sense> rhs, sense one of <=, >=, ==."""
+        expr = self.quicksum(coef * var for coef, var in terms)
+        if sense == "<=":
+            return self.m.addCons(expr <= rhs)
+        if sense == ">=":
+            return self.m.addCons(expr >= rhs)
+        return self.m.addCons(expr == rhs)
+
+    def set_obj_min_terms(self, terms):
+        self.set_obj_min(self.quicksum(coef * var for coef, var in terms))
+
     def set_obj_min(self, expr):
         self.m.setObjective(expr, self.MINIMIZE)
 
     def set_obj_max(self, expr):
         self.m.setObjective(expr, self.MAXIMIZE)
 
+    def warm_start(self, values):
+        """Hand SCIP a partial solution of (var, value) pairs; it completes the rest."""
+        sol = self.m.createPartialSol()
+        for var, value in values:
+            self.m.setSolVal(sol, var, value)
+        self.warm_started = self.m.addSol(sol)
+        return self.warm_started
+
+    def dump_incumbents(self, dump):
+        """Call ``dump(value)`` with a value(var) lookup of the best solution as it improves."""
+        self._dump = dump
+        if self.profile.threads > 1:
+            # event handlers are not copied to the concurrent solvers, so SCIP reports
+            # their solutions to this one only when the solve ends
+            print("Warning: with several solver threads, incumbents are only written when the solve ends")
+        self.m.includeEventhdlr(
+            _IncumbentDump(self, dump, self.profile.incumbent_interval), "incumbent_dump", "write improving solutions"
+        )
+
     def optimize(self):
-        self.m.optimize()
+        build = time.perf_counter() - self.created
+        if self.profile.threads > 1:
+            self.m.setIntParam("parallel/maxnthreads", self.profile.threads)
+            self.m.solveConcurrent()
+        else:
+            self.m.optimize()
+        self.times = {"build_s": build, "solving_s": self.m.getSolvingTime()}
+        sols = self.m.getSols()
+        if sols:
+            self.times["first_incumbent_s"] = min(self.m.getSolTime(sol) for sol in sols)
+            self.times["optimal_s"] = self.m.getSolTime(self.m.getBestSol())
+        if self.log_path:
+            self.m.setLogfile(None)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(
+                    "{}: model built in {:.2f}s, first incumbent after {:.2f}s, best incumbent after {:.2f}s, "
+                    "solved in {:.2f}s\n".format(
+                        "warm start" if self.warm_started else "cold start",
+                        self.times["build_s"],
+                        self.times.get("first_incumbent_s", float("nan")),
+                        self.times.get("optimal_s", float("nan")),
+                        self.times["solving_s"],
+                    )
+                )
+        if self._dump is not None and sols:
+            self._dump(self.val)
+        self._collect_report()
+
+    def _collect_report(self):
+        # infinite bounds and gaps (no solution) are stored as None
+        def finite(value):
+            return value if abs(value) < 1e20 else None
+
+        m = self.m
+        self.report = {
+            "status": m.getStatus(),
+            "primal_bound": finite(m.getPrimalbound()),
+            "dual_bound": finite(m.getDualbound()),
+            "gap": finite(m.getGap()),
+            "nodes": m.getNTotalNodes(),
+            "lp_iterations": m.getNLPIterations(),
+            "variables": m.getNVars(transformed=False),
+            "constraints": m.getNConss(transformed=False),
+            "presolved_variables": m.getNVars(transformed=True),
+            "presolved_constraints": m.getNConss(transformed=True),
+            "warm_start": self.warm_started,
+            "threads": self.profile.threads,
+            "build_s": self.times["build_s"],
+            "reading_s": m.getReadingTime(),
+            "presolving_s": m.getPresolvingTime(),
+            "solving_s": m.getSolvingTime(),
+            "first_incumbent_s": self.times.get("first_incumbent_s"),
+            "optimal_s": self.times.get("optimal_s"),
+        }
+
+    def add_cont_var(self, lb: float, ub: float):
+        return self.m.addVar(vtype="CONTINUOUS", lb=lb, ub=ub)
+
+    def num_vars(self):
+        return self.m.getNVars()
+
+    def num_constrs(self):
+        return self.m.getNConss()
 
     def val(self, var):
         return self.m.getVal(var)
 
+    def sol_val(self, sol, var):
+        return self.m.getSolVal(sol, var)
+
+    def obj_val(self):
+        return self.m.getObjVal()
+
     def close(self):
         pass
 
 
+class _LPSolver(_Solver):
+    """Streams the model to a CPLEX LP file and lets SCIP read it in one call,
+    instead of creating every variable and constraint through the Python API.
+    Variables are plain integers until the file is read."""
+
+    ROW_TERMS = 64  # terms per line of the LP file
+
+    def __init__(
+        self, name: str, log_path: str = None, time_limit: int = 1800, enable_heuristics: bool = False,
+        profile: SolverProfile = None,
+    ):
+        super().__init__(name, log_path, time_limit, enable_heuristics, profile)
+        self.lp_dir = tempfile.mkdtemp(prefix="asrel_lp_")
+        self._rows = open(os.path.join(self.lp_dir, "rows.lp"), "w", encoding="ascii")
+        self._nvars = 0
+        self._nrows = 0
+        self._binaries = []
+        self._bounds = []
+        self._objective = []
+        self._vars = None
+
+    def add_bin_vars(self, n: int):
+        first = self._nvars
+        self._nvars += n
+        self._binaries.append((first, self._nvars))
+        return list(range(first, self._nvars))
+
+    def add_cont_var(self, lb: float, ub: float):
+        self._nvars += 1
+        self._bounds.append((self._nvars - 1, lb, ub))
+        return self._nvars - 1
+
+    def _format_terms(self, terms):
+        merged = {}
+        for coef, var in terms:
+            merged[var] = merged.get(var, 0) + coef
+        parts = [f"{coef:+.17g} v{var}" for var, coef in merged.items() if coef]
+        if not parts:
+            return "0 v0"
+        return "\n ".join(" ".join(parts[k : k + self.ROW_TERMS]) for k in range(0, len(parts), self.ROW_TERMS))
+
+    def add_row(self, terms, sense, rhs):
+        self._rows.write(f" c{self._nrows}: {self._format_terms(terms)} {'=' if sense == '==' else sense} {rhs:.17g}\n")
+        self._nrows += 1
+
+    def set_obj_min_terms(self, terms):
+        self._objective = terms
+
+    def _load(self):
+        if self._vars is not None:
+            return
+        self._rows.close()
+        lp_file = os.path.join(self.lp_dir, "model.lp")
+        with open(lp_file, "w", encoding="ascii") as f:
+            f.write(f"Minimize\n obj: {self._format_terms(self._objective)}\nSubject To\n")
+            with open(self._rows.name, "r", encoding="ascii") as rows:
+                shutil.copyfileobj(rows, f)
+            f.write("Bounds\n")
+            for var, lb, ub in self._bounds:
+                f.write(f" {lb:.17g} <= v{var} <= {ub:.17g}\n")
+            f.write("Binaries\n")
+            for first, last in self._binaries:
+                for start in range(first, last, self.ROW_TERMS):
+                    f.write(" " + " ".join(f"v{var}" for var in range(start, min(start + self.ROW_TERMS, last))) + "\n")
+            f.write("End\n")
+        self.m.readProblem(lp_file)
+        shutil.rmtree(self.lp_dir, ignore_errors=True)
+        # variables that appear in no row or objective are absent from the model
+        names = {var.name: var for var in self.m.getVars()}
+        self._vars = [names.get(f"v{var}") for var in range(self._nvars)]
+
+    def warm_start(self, values):
+        self._load()
+        return super().warm_start(
+            [(self._vars[var], value) for var, value in values if self._vars[var] is not None]
+        )
+
+    def optimize(self):
+        self._load()
+        super().optimize()
+
+    def num_vars(self):
+        return self._nvars
+
+    def num_constrs(self):
+        return self._nrows
+
+    def val(self, var):
+        var = self._vars[var]
+        return 0.0 if var is None else self.m.getVal(var)
+
+    def sol_val(self, sol, var):
+        var = self._vars[var]
+        return 0.0 if var is None else self.m.getSolVal(sol, var)
+
+    def close(self):
+        if not self._rows.closed:
+            self._rows.close()
+        shutil.rmtree(self.lp_dir, ignore_errors=True)
+
+
 class ASRelSolver(object):
-    def __init__(self, paths) -> None:
+    def __init__(self, paths, solver="scip", builder="api", profile=None, cache=None) -> None:
         self.paths = paths
+        self.solver = solver  # "scip" or "heuristic" (asrel_heuristic local search)
+        self.builder = builder  # how SCIP models are built, see SOLVERS
+        self.profile = profile or SolverProfile()  # SCIP limits, threads and incumbent dumps
+        self.cache = cache  # ComponentCache of components solved by earlier runs
         self.linknum = 0
         self.idx2link = None
         self.idxpaths = None
         self.revlinks = None
+        self.stats = {}
+
+    def _iter_paths(self):
+        if isinstance(self.paths, PathCorpus):
+            yield from self.paths.iter_paths()
+        else:
+            for path in self.paths:
+                yield path, 1
 
     def _link2idx(self):
-        links = SortedDict()
+        """Number the links and turn paths into link idx lists. Of a path and its
+        exact reverse only the smaller one is kept, with their counts merged: the
+        reverse-link constraints make their rows mirror images. Their links all
+        stay, and ``heads`` counts the paths of the input starting at each link."""
+        links = {}
         idxsubpaths = []
+        pathnums = []
+        kept = {}  # path -> position in idxsubpaths
+        heads = []
+        merged = 0
         idx = 0
-        for path in self.paths:
+        for path, num in self._iter_paths():
             idxpath = [None for _ in range(len(path) - 1)]
             for i in range(len(path) - 1):
                 link = path[i : i + 2]
                 if link not in links:
                     links[link] = idx
+                    heads.append(0)
                     idx += 1
                 idxpath[i] = links[link]
+            if idxpath:
+                heads[idxpath[0]] += 1
+            rev = path[::-1]
+            # a self link such as a prepended a-a has no reverse link to mirror it
+            if rev in kept and all(path[i] != path[i + 1] for i in range(len(path) - 1)):
+                pos = kept[rev]
+                pathnums[pos] += num
+                merged += 1
+                if path < rev:
+                    del kept[rev]
+                    kept[path] = pos
+                    idxsubpaths[pos] = idxpath
+                continue
+            kept[path] = len(idxsubpaths)
             idxsubpaths.append(idxpath)
+            pathnums.append(num)
 
         self.idxpaths = idxsubpaths
+        self.pathnums = pathnums
+        self.merged_paths = merged
+        self.heads = heads
         self.linknum = idx
-        self.idx2link = SortedDict({v: k for k, v in links.items()})
+        if isinstance(self.paths, PathCorpus):
+            to_asns = self.paths.to_asns
+            self.idx2link = SortedDict({v: to_asns(k) for k, v in links.items()})
+        else:
+            self.idx2link = SortedDict({v: k for k, v in links.items()})
 
         self.revlinks = []
-        for link, idx in links.items():
-            if (link[1], link[0]) in links and int(link[0]) < int(link[1]):
-                self.revlinks.append([idx, links[(link[1], link[0])]])
+        for link in sorted(links):
+            as1, as2 = self.idx2link[links[link]]
+            if (link[1], link[0]) in links and int(as1) < int(as2):
+                self.revlinks.append([links[link], links[(link[1], link[0])]])
 
-    def solute_asrel_for_clinks(self, log_dir):
-        self._link2idx()
-        print("solute asrel for clinks with unsat link")
+    def _components(self):
+        """Group links that share a path or a reverse-link constraint; each group is
+        an independent sub-problem. Returns (links, path idxs, revlinks) per group."""
+        parent = list(range(self.linknum))
 
-        log_path = os.path.join(log_dir, 'unsat_asrel_infer.log')
-        solver = _Solver(
-            name="infer_asrel",
-            log_path=log_path,
-            time_limit=1800,
-            enable_heuristics=True
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        def union(i, j):
+            i, j = find(i), find(j)
+            if i != j:
+                parent[max(i, j)] = min(i, j)
+
+        for path in self.idxpaths:
+            for i in path[1:]:
+                union(path[0], i)
+        for idx1, idx2 in self.revlinks:
+            union(idx1, idx2)
+
+        groups = {}
+        for i in range(self.linknum):
+            groups.setdefault(find(i), ([], [], []))[0].append(i)
+        for p, path in enumerate(self.idxpaths):
+            if path:
+                groups[find(path[0])][1].append(p)
+        for rev in self.revlinks:
+            groups[find(rev[0])][2].append(rev)
+        return list(groups.values())
+
+    def _batches(self, components, batch_links):
+        # large components are solved alone, small ones are packed together
+        batches, current = [], ([], [], [])
+        for links, paths, revlinks in sorted(components, key=lambda g: -len(g[0])):
+            if len(links) >= batch_links:
+                batches.append((links, paths, revlinks))
+                continue
+            current[0].extend(links)
+            current[1].extend(paths)
+            current[2].extend(revlinks)
+            if len(current[0]) >= batch_links:
+                batches.append(current)
+                current = ([], [], [])
+        if current[0]:
+            batches.append(current)
+        return batches
+
+    def _subproblem(self, links, paths, revlinks):
+        links = sorted(links)
+        local = {link: i for i, link in enumerate(links)}
+        return (
+            links,
+            [[local[i] for i in self.idxpaths[p]] for p in sorted(paths)],
+            [[local[idx1], local[idx2]] for idx1, idx2 in revlinks],
         )
 
-        linknum = self.linknum
-        x = solver.add_bin_vars(linknum)
-        y = solver.add_bin_vars(linknum)
-        z = solver.add_bin_vars(linknum)
+    def _fingerprint(self, kind, links, paths, revlinks, options, link_data):
+        """Key of a component that does not depend on link numbering: links are
+        renumbered in ASN order and paths and reverse pairs sorted. Returns the key
+        and the component's links in that order."""
+        links = sorted(links, key=lambda link: self.idx2link[link])
+        local = {link: i for i, link in enumerate(links)}
+        # only optimal SCIP solutions are stored, so neither warm-start hints nor the SCIP
+        # threads, limits and heuristics are part of the key; heuristic solutions get keys
+        # of their own through "solver", and depend on how long the search ran
+        desc = {
+            "model_version": MODEL_VERSION,
+            "kind": kind,
+            "solver": options["solver"],
+            "reduce": options["reduce"],
+            "time_limit": self.profile.time_limit if options["solver"] == "heuristic" else None,
+            "links": [list(self.idx2link[link]) for link in links],
+            "paths": sorted([local[i] for i in self.idxpaths[p]] for p in paths),
+            "revlinks": sorted(sorted([local[idx1], local[idx2]]) for idx1, idx2 in revlinks),
+            "heads": [link_data["heads"][link] for link in links] if "heads" in link_data else None,
+        }
+        return fingerprint(desc), links
 
-        for i in range(linknum):
-            solver.add_constr(y[i] >= x[i] - z[i])
-            solver.add_constr(x[i] >= z[i])
-            solver.add_constr(y[i] + z[i] <= 1)
+    def _lookup(self, kind, components, options, link_data, rels):
+        """Fill ``rels`` from cached components; returns the components left to solve
+        with their keys."""
+        todo, hits, hit_links = [], 0, 0
+        for links, paths, revlinks in components:
+            key, ordered = self._fingerprint(kind, links, paths, revlinks, options, link_data)
+            entry = self.cache.get(key)
+            if entry is None:
+                todo.append(((links, paths, revlinks), key, ordered))
+                continue
+            for link, rel in zip(ordered, entry["rels"]):
+                rels[link] = rel
+            hits += 1
+            hit_links += len(links)
+        self.stats["cached_components"] = hits
+        self.stats["cached_links"] = hit_links
+        print(f"Reusing {hits}/{len(components)} solved components ({hit_links} links) from the component cache")
+        return todo
 
-        idx_pair=set()
-        for path in self.idxpaths:
-            solver.add_constr(solver.quicksum(x[i] - z[i] for i in path) <= 1)
-            if len(path) >= 2:
-                for i in range(1, len(path)):
-                    for j in range(i):
-                        idx_pair.add((path[i], path[j]))
-        for i, j in idx_pair:
-            solver.add_constr(y[i] + z[i] >= y[j])
-            solver.add_constr(
-                y[i] + 2 * z[i] - x[i] >= y[j] - x[j]
+    def _degrees(self):
+        neighbours = {}
+        for as1, as2 in self.idx2link.values():
+            neighbours.setdefault(as1, set()).add(as2)
+            neighbours.setdefault(as2, set()).add(as1)
+        return [(len(neighbours[as1]), len(neighbours[as2])) for as1, as2 in self.idx2link.values()]
+
+    def _solve(self, kind, log_path, workers=1, reduce=False, hints=None, batch_links=BATCH_LINKS, cache=None):
+        rels = [None] * self.linknum
+        options = {"solver": self.solver, "reduce": reduce, "builder": self.builder, "profile": self.profile}
+        # per-link inputs, cut down to the links of each batch
+        link_data = {}
+        if self.solver == "scip" and self.profile.incumbent_interval:
+            link_data["names"] = list(self.idx2link.values())
+        if hints is not None:
+            link_data["hints"] = hints
+        if self.solver == "heuristic":
+            link_data["degrees"] = self._degrees()
+        if kind == "elink":
+            link_data["heads"] = self.heads
+        if workers <= 1 and cache is None:
+            rels, self.stats = _solve_subproblem(
+                (kind, self.linknum, self.idxpaths, self.revlinks, log_path, options, link_data)
             )
+            self.stats["paths"] = len(self.idxpaths)
+            self.stats["merged_paths"] = self.merged_paths
+            self.stats["links"] = self.linknum
+            self._summarize_scip()
+            return rels
 
-        revidx = SortedSet()
-        for idx1, idx2 in self.revlinks:
-            solver.add_constr(x[idx1] == x[idx2])
-            solver.add_constr(z[idx1] == z[idx2])
-            solver.add_constr(y[idx1] + y[idx2] - x[idx1] + 2 * z[idx1] == 1)
-            revidx.add(idx1)
+        components = self._components()
+        self.stats = {}
+        todo = []
+        if cache is not None:
+            todo = self._lookup(kind, components, options, link_data, rels)
+            components_left = [component for component, _, _ in todo]
+        else:
+            components_left = components
+        if workers <= 1:
+            # one model for everything that is left, as without the cache
+            batches = self._batches(components_left, max(self.linknum, 1)) if components_left else []
+        else:
+            batches = self._batches(components_left, batch_links)
+        print(
+            f"Solving {len(components_left)} independent components in "
+            f"{len(batches)} batches with {workers} processes"
+        )
+        tasks, batch_links_list = [], []
+        root, ext = os.path.splitext(log_path)
+        for k, (links, paths, revlinks) in enumerate(batches):
+            links, idxpaths, local_revlinks = self._subproblem(links, paths, revlinks)
+            batch_links_list.append(links)
+            local_data = {name: [data[link] for link in links] for name, data in link_data.items()}
+            batch_log = log_path if workers <= 1 else f"{root}_{k}{ext}"
+            tasks.append((kind, len(links), idxpaths, local_revlinks, batch_log, options, local_data))
+        self.stats.update({
+            "paths": len(self.idxpaths),
+            "merged_paths": self.merged_paths,
+            "links": self.linknum,
+            "components": len(components),
+            "batches": len(batches),
+        })
+        if not tasks:
+            self._summarize_scip()
+            return rels
+        if workers <= 1:
+            statuses = self._collect(map(_solve_subproblem, tasks), batch_links_list, rels)
+        else:
+            with Pool(min(workers, len(tasks))) as pool:
+                statuses = self._collect(pool.imap(_solve_subproblem, tasks), batch_links_list, rels)
+        if cache is not None:
+            batch_of = {link: k for k, links in enumerate(batch_links_list) for link in links}
+            stored = 0
+            for _, key, ordered in todo:
+                # a batch optimum restricted to one of its independent components is optimal for
+                # it; an incumbent left by a time or memory limit is not reused by later runs
+                if statuses[batch_of[ordered[0]]] not in (None, "optimal"):
+                    continue
+                cache.put(key, {"kind": kind, "rels": [rels[link] for link in ordered]})
+                stored += 1
+            self.stats["stored_components"] = stored
+            cache.evict()
+        self._summarize_scip()
+        return rels
 
-        solver.set_obj_min(solver.quicksum(z[i] for i in range(linknum)))
-        solver.optimize()
+    def _summarize_scip(self):
+        """Worst SCIP outcome over all models: status "optimal" only if every
+        model was solved to optimality, else the other statuses joined by ",".
+        Heuristic solutions that leave paths violated get status "infeasible"."""
+        if self.stats.get("violations"):
+            self.stats["status"] = "infeasible"
+            self.stats["max_gap"] = None
+        reports = self.stats.get("scip")
+        if not reports:
+            return
+        statuses = sorted({report["status"] for report in reports} - {"optimal"})
+        self.stats["status"] = ",".join(statuses) if statuses else "optimal"
+        gaps = [report["gap"] for report in reports]
+        self.stats["max_gap"] = None if None in gaps else max(gaps)
+        self.stats["nodes"] = sum(report["nodes"] for report in reports)
 
-        asrel = SortedDict()
-        for i in range(linknum):
-            if i in revidx:
-                continue
-            zi = solver.val(z[i])
-            xi = solver.val(x[i])
-            yi = solver.val(y[i])
-            if zi == 1.0:
-                asrel[self.idx2link[i]] = 0
-            elif xi == 1.0:
-                asrel[self.idx2link[i]] = 0
-            elif yi == 1.0:
-                asrel[self.idx2link[i]] = -1
+    def _collect(self, results, batch_links_list, rels):
+        """Merge the batch results into ``rels`` and the stats; returns the SCIP
+        status of every batch (for the heuristic, None or "infeasible" if it
+        left paths violated)."""
+        statuses = []
+        for k, (local_rels, stats) in enumerate(results):
+            if "scip" in stats:
+                statuses.append(stats["scip"][0]["status"])
             else:
-                asrel[self.idx2link[i]] = 1
+                statuses.append("infeasible" if stats["violations"] else None)
+            for link, rel in zip(batch_links_list[k], local_rels):
+                rels[link] = rel
+            for name, value in stats.items():
+                if name.endswith("_s"):  # batches run concurrently
+                    self.stats[name] = max(self.stats.get(name, 0), value)
+                elif isinstance(value, list):
+                    self.stats.setdefault(name, []).extend(value)
+                else:
+                    self.stats[name] = self.stats.get(name, 0) + value
+        return statuses
 
-        solver.close()
+    def _to_asrel(self, rels):
+        asrel = SortedDict()
+        for i, rel in enumerate(rels):
+            if rel is not None:
+                asrel[self.idx2link[i]] = rel
         return asrel
 
-    def solute_asrel_for_elinks(self, log_dir):
+    def _hints(self, prior):
+        # relationship of every link in a prior {(as1, as2): rel} map, reversed if needed
+        hints = [None] * self.linknum
+        for i, (as1, as2) in self.idx2link.items():
+            if (as1, as2) in prior:
+                hints[i] = prior[(as1, as2)]
+            elif (as2, as1) in prior:
+                hints[i] = -prior[(as2, as1)]
+        return hints
+
+    def solute_asrel_for_clinks(self, log_dir, workers=1, reduce=False, check=False, prior=None):
+        """With ``reduce``, self pairs are dropped and long paths get prefix-chain
+        ordering constraints; ``check`` also solves the full model and raises if
+        the optimal objectives differ. ``prior`` ({(as1, as2): rel}, e.g. from
+        read_asrel) warm-starts SCIP with a partial solution. With a component
+        cache, the objective covers only the components that were solved;
+        ``check`` solves both models without the cache."""
         self._link2idx()
-        print("solute asrel for elinks")
+        print("solute asrel for clinks with unsat link")
+        if self.solver != "scip":  # model reductions only apply to the SCIP model
+            reduce = False
+        log_path = os.path.join(log_dir, 'unsat_asrel_infer.log')
+        hints = None
+        if prior is not None:
+            hints = self._hints(prior)
+            known = sum(rel is not None for rel in hints)
+            print(f"Warm start from {known}/{self.linknum} links of the prior relationships")
+        cache = None if reduce and check else self.cache
+        rels = self._solve("clink", log_path, workers, reduce, hints, cache=cache)
+        if hints is not None:
+            self.stats["warm_start_links"] = known
+        if reduce:
+            # prefix chains of long paths can outnumber the pairs they replace
+            removed = self.stats.get("constraints_removed", 0)
+            print(
+                "Reduced clink model: {} constraints {} and {} auxiliary variables added".format(
+                    abs(removed), "removed" if removed >= 0 else "added", self.stats.get("variables_added", 0)
+                )
+            )
+        if reduce and check:
+            stats = self.stats
+            self._solve("clink", os.path.join(log_dir, 'unsat_asrel_infer_full.log'), workers)
+            stats["full_objective"] = self.stats["objective"]
+            self.stats = stats
+            if abs(stats["full_objective"] - stats["objective"]) > 1e-6:
+                raise RuntimeError(
+                    "reduced clink model objective {} differs from the full model's {}".format(
+                        stats["objective"], stats["full_objective"]
+                    )
+                )
+        return self._to_asrel(rels)
 
+    def solute_asrel_for_elinks(self, log_dir, workers=1):
+        self._link2idx()
+        print("solute asrel for elinks")
         log_path = os.path.join(log_dir, "elinks_asrel_infer.log")
-        solver = _Solver(
-            name="infer_asrel_for_elinks",
-            log_path=log_path,
-            time_limit=1800
+        return self._to_asrel(self._solve("elink", log_path, workers, cache=self.cache))
+
+
+# "api" adds variables and constraints one by one, "lp" streams an LP file that SCIP reads at once
+SOLVERS = {"api": _Solver, "lp": _LPSolver}
+
+
+def _solve_subproblem(task):
+    """Solve one clink/elink model; returns the relationship of every link (None
+    for the first link of a reverse pair, which its partner represents) and the
+    model size."""
+    kind, linknum, idxpaths, revlinks, log_path, options, link_data = task
+    if options["solver"] == "heuristic":
+        time_limit = options["profile"].time_limit
+        return solve_heuristic(
+            kind, linknum, idxpaths, revlinks, log_path, link_data.get("degrees"), link_data.get("hints"),
+            link_data.get("heads"), HEURISTIC_TIME_LIMIT if time_limit is None else time_limit,
+        )
+    if kind == "clink":
+        return _solve_clinks(
+            linknum, idxpaths, revlinks, log_path, options["reduce"], link_data.get("hints"), options["builder"],
+            options["profile"], link_data.get("names"),
         )
-        linknum = self.linknum
-        x = solver.add_bin_vars(linknum)
-        y = solver.add_bin_vars(linknum)
+    return _solve_elinks(
+        linknum, idxpaths, revlinks, log_path, options["builder"], options["profile"], link_data.get("names"),
+        link_data.get("heads"),
+    )
 
-        for i in range(linknum):
-            solver.add_constr(y[i] >= x[i])
 
-        revidx = SortedSet()
-        for idx1, idx2 in self.revlinks:
-            solver.add_constr(x[idx1] == x[idx2])
-            solver.add_constr(y[idx1] + y[idx2] - x[idx1] == 1)
-            revidx.add(idx1)
-
-        idx_pair=set()
-        for p in self.idxpaths:
-            solver.add_constr(solver.quicksum(x[i] for i in p) <= 1)
-            for i in range(len(p) - 1):
-                idx_pair.add((p[i],p[i + 1]))
-        for i, j in idx_pair:
-            solver.add_constr(y[i] <= y[j])
-            solver.add_constr(y[i] - x[i] <= y[j] - x[j])
-
-        solver.set_obj_min(solver.quicksum(-x[path[0]] for path in self.idxpaths))
-        solver.optimize()
+def _model_stats(solver):
+    return {"variables": solver.num_vars(), "constraints": solver.num_constrs()}
 
-        asrel = SortedDict()
-        for i in range(linknum):
-            if i in revidx:
+
+def _incumbent_writer(log_path, names, decode):
+    """dump callback writing the as1|as2|rel links of a solution next to log_path;
+    ``decode(value)`` turns a value(var) lookup into per-link relationships."""
+    incumbent_file = os.path.splitext(log_path)[0] + "_incumbent.txt"
+
+    def dump(value):
+        tmp_file = incumbent_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8", newline="\n") as f:
+            for (as1, as2), rel in zip(names, decode(value)):
+                if rel is not None:
+                    f.write(f"{as1}|{as2}|{rel}\n")
+        os.replace(tmp_file, incumbent_file)
+
+    return dump
+
+
+def _order_pairs(path):
+    for i in range(1, len(path)):
+        for j in range(i):
+            yield path[i], path[j]
+
+
+def read_asrel(asrel_file):
+    """{(as1, as2): rel} of an as1|as2|rel file such as init_core_link.txt."""
+    asrel = {}
+    with open(asrel_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
                 continue
-            xi = solver.val(x[i])
-            yi = solver.val(y[i])
-            if xi == 1.0:
-                asrel[self.idx2link[i]] = 0
-            elif yi == 1.0:
-                asrel[self.idx2link[i]] = -1
-            else:
-                asrel[self.idx2link[i]] = 1
+            as1, as2, rel = line.strip().split("|")[:3]
+            asrel[(as1, as2)] = int(rel)
+    return asrel
 
-        solver.close()
-        return asrel
+
+def _clink_rels(linknum, revidx, x, y, z, value):
+    rels = [None] * linknum
+    for i in range(linknum):
+        if i in revidx:
+            continue
+        zi = value(z[i])
+        xi = value(x[i])
+        yi = value(y[i])
+        if zi == 1.0:
+            rels[i] = 0
+        elif xi == 1.0:
+            rels[i] = 0
+        elif yi == 1.0:
+            rels[i] = -1
+        else:
+            rels[i] = 1
+    return rels
+
+
+def _solve_clinks(
+    linknum, idxpaths, revlinks, log_path, reduce=False, hints=None, builder="api", profile=None, names=None
+):
+    solver = SOLVERS[builder](
+        name="infer_asrel",
+        log_path=log_path,
+        time_limit=1800,
+        enable_heuristics=True,
+        profile=profile,
+    )
+
+    x = solver.add_bin_vars(linknum)
+    y = solver.add_bin_vars(linknum)
+    z = solver.add_bin_vars(linknum)
+
+    for i in range(linknum):
+        solver.add_row([(1, y[i]), (-1, x[i]), (1, z[i])], ">=", 0)
+        solver.add_row([(1, x[i]), (-1, z[i])], ">=", 0)
+        solver.add_row([(1, y[i]), (1, z[i])], "<=", 1)
+
+    idx_pair=set()
+    chains = []
+    for path in idxpaths:
+        solver.add_row([term for i in path for term in ((1, x[i]), (-1, z[i]))], "<=", 1)
+        if reduce and len(path) >= CHAIN_MIN_LINKS:
+            chains.append(path)
+        elif len(path) >= 2:
+            idx_pair.update(_order_pairs(path))
+    pair_num = 0
+    for i, j in idx_pair:
+        if reduce and i == j:
+            # y[i] + z[i] >= y[i] and y[i] + 2z[i] - x[i] >= y[i] - x[i] always hold
+            continue
+        pair_num += 1
+        solver.add_row([(1, y[i]), (1, z[i]), (-1, y[j])], ">=", 0)
+        solver.add_row([(1, y[i]), (2, z[i]), (-1, x[i]), (-1, y[j]), (1, x[j])], ">=", 0)
+
+    # The pair constraints are not transitive (an unsat link constrains nothing
+    # after it), so a long path instead carries the running maxima of y and y - x
+    # over its prefix and bounds each link by the maxima before it.
+    aux_num = 0
+    for path in chains:
+        # m and n as terms, so that the first link needs no auxiliary variable
+        m, n = [(1, y[path[0]])], [(1, y[path[0]]), (-1, x[path[0]])]
+        for k in range(1, len(path)):
+            i, j = path[k], path[k - 1]
+            if k > 1:
+                m_next, n_next = solver.add_cont_var(0, 1), solver.add_cont_var(-1, 1)
+                aux_num += 2
+                solver.add_row([(1, m_next)] + [(-c, v) for c, v in m], ">=", 0)
+                solver.add_row([(1, m_next), (-1, y[j])], ">=", 0)
+                solver.add_row([(1, n_next)] + [(-c, v) for c, v in n], ">=", 0)
+                solver.add_row([(1, n_next), (-1, y[j]), (1, x[j])], ">=", 0)
+                m, n = [(1, m_next)], [(1, n_next)]
+            solver.add_row([(1, y[i]), (1, z[i])] + [(-c, v) for c, v in m], ">=", 0)
+            solver.add_row([(1, y[i]), (2, z[i]), (-1, x[i])] + [(-c, v) for c, v in n], ">=", 0)
+
+    revidx = SortedSet()
+    for idx1, idx2 in revlinks:
+        solver.add_row([(1, x[idx1]), (-1, x[idx2])], "==", 0)
+        solver.add_row([(1, z[idx1]), (-1, z[idx2])], "==", 0)
+        solver.add_row([(1, y[idx1]), (1, y[idx2]), (-1, x[idx1]), (2, z[idx1])], "==", 1)
+        revidx.add(idx1)
+
+    solver.set_obj_min_terms([(1, z[i]) for i in range(linknum)])
+    stats = _model_stats(solver)
+    if hints is not None:
+        # a prior p2p link may have been p2p or unsat, so its y and z are left to SCIP
+        values = []
+        for i, rel in enumerate(hints):
+            if rel == 0:
+                values.append((x[i], 1.0))
+            elif rel is not None:
+                values += [(x[i], 0.0), (y[i], 1.0 if rel == -1 else 0.0), (z[i], 0.0)]
+        solver.warm_start(values)
+    if reduce:
+        full_pairs = set()
+        for path in idxpaths:
+            full_pairs.update(_order_pairs(path))
+        pair_constrs = 2 * pair_num + 6 * sum(max(len(path) - 2, 0) for path in chains) + 2 * len(chains)
+        stats["constraints_removed"] = 2 * len(full_pairs) - pair_constrs
+        stats["variables_added"] = aux_num
+    if names is not None:
+        solver.dump_incumbents(
+            _incumbent_writer(log_path, names, lambda value: _clink_rels(linknum, revidx, x, y, z, value))
+        )
+    solver.optimize()
+    stats["objective"] = solver.obj_val()
+    stats.update(solver.times)
+    stats["scip"] = [solver.report]  # one entry per model, concatenated across batches
+
+    rels = _clink_rels(linknum, revidx, x, y, z, solver.val)
+
+    solver.close()
+    return rels, stats
+
+
+def _elink_rels(linknum, revidx, x, y, value):
+    rels = [None] * linknum
+    for i in range(linknum):
+        if i in revidx:
+            continue
+        xi = value(x[i])
+        yi = value(y[i])
+        if xi == 1.0:
+            rels[i] = 0
+        elif yi == 1.0:
+            rels[i] = -1
+        else:
+            rels[i] = 1
+    return rels
+
+
+def _solve_elinks(linknum, idxpaths, revlinks, log_path, builder="api", profile=None, names=None, heads=None):
+    solver = SOLVERS[builder](
+        name="infer_asrel_for_elinks",
+        log_path=log_path,
+        time_limit=1800,
+        profile=profile,
+    )
+    x = solver.add_bin_vars(linknum)
+    y = solver.add_bin_vars(linknum)
+
+    for i in range(linknum):
+        solver.add_row([(1, y[i]), (-1, x[i])], ">=", 0)
+
+    revidx = SortedSet()
+    for idx1, idx2 in revlinks:
+        solver.add_row([(1, x[idx1]), (-1, x[idx2])], "==", 0)
+        solver.add_row([(1, y[idx1]), (1, y[idx2]), (-1, x[idx1])], "==", 1)
+        revidx.add(idx1)
+
+    idx_pair=set()
+    for p in idxpaths:
+        solver.add_row([(1, x[i]) for i in p], "<=", 1)
+        for i in range(len(p) - 1):
+            idx_pair.add((p[i],p[i + 1]))
+    for i, j in idx_pair:
+        solver.add_row([(1, y[i]), (-1, y[j])], "<=", 0)
+        solver.add_row([(1, y[i]), (-1, x[i]), (-1, y[j]), (1, x[j])], "<=", 0)
+
+    if heads is None:
+        solver.set_obj_min_terms([(-1, x[path[0]]) for path in idxpaths])
+    else:
+        # a dropped reverse path starts with the reverse of its partner's last link
+        solver.set_obj_min_terms([(-num, x[i]) for i, num in enumerate(heads) if num])
+    stats = _model_stats(solver)
+    if names is not None:
+        solver.dump_incumbents(
+            _incumbent_writer(log_path, names, lambda value: _elink_rels(linknum, revidx, x, y, value))
+        )
+    solver.optimize()
+    stats["objective"] = solver.obj_val()
+    stats.update(solver.times)
+    stats["scip"] = [solver.report]  # one entry per model, concatenated across batches
+
+    rels = _elink_rels(linknum, revidx, x, y, solver.val)
+
+    solver.close()
+    return rels, stats
@@ -0,0 +1,34 @@
+import argparse
+import tempfile
+import time
+
+from asrel_solver import ASRelSolver
+from gibbs_sampling import read_core_paths
+
+
+def bench(corepathfile, solvers=("scip", "heuristic"), builders=("api",)):
+    paths = list(read_core_paths(corepathfile))
+    log_dir = tempfile.mkdtemp(prefix="bench_asrel_solver_")
+    print(f"{len(paths)} core paths, solver logs in {log_dir}")
+    print(f"{'solver':<16}{'objective':>10}{'violations':>12}{'build s':>10}{'solve s':>10}{'total s':>10}")
+    runs = [(solver, builder) for solver in solvers for builder in (builders if solver == "scip" else [None])]
+    for solver, builder in runs:
+        asrel_solver = ASRelSolver(paths, solver, builder or "api")
+        st = time.perf_counter()
+        asrel_solver.solute_asrel_for_clinks(log_dir)
+        duration = time.perf_counter() - st
+        stats = asrel_solver.stats
+        name = f"{solver}/{builder}" if builder else solver
+        print(
+            f"{name:<16}{stats['objective']:>10.0f}{stats.get('violations', 0):>12}"
+            f"{stats.get('build_s', 0):>10.2f}{stats['solving_s']:>10.2f}{duration:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare clink objectives and build/solve times of the SCIP builders and the heuristic")
+    parser.add_argument("--corepath_file", type=str, required=True, help="corepath.txt written by asrel_prob.py")
+    parser.add_argument("--solver", choices=["scip", "heuristic"], action="append", help="Solvers to run (default: both)")
+    parser.add_argument("--model_builder", choices=["api", "lp"], action="append", help="SCIP model builders to run (default: api)")
+    args = parser.parse_args()
+    bench(args.corepath_file, args.solver or ("scip", "heuristic"), args.model_builder or ("api",))
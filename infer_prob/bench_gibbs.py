@@ -0,0 +1,77 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from gibbs_sampling import GibbsSampling, read_core_paths
+
+
+def _run(paths, engine, seed, n_iter, workers=1, estimator="counts"):
+    np.random.seed(seed)  # the dict engine draws from the global random state
+    gibbs_sampling = GibbsSampling(paths, {}, engine=engine, seed=seed, workers=workers, estimator=estimator)
+    st = time.perf_counter()
+    prob = gibbs_sampling.infer_asrel_prob(n_iter)
+    return np.array(list(prob.values())), time.perf_counter() - st
+
+
+def bench(corepathfile, n_iter=100, engines=GibbsSampling.ENGINES, workers=1):
+    """Time per sweep of each engine, and the mean absolute difference of their
+    probabilities against that of the same engine under another seed."""
+    paths = read_core_paths(corepathfile)
+    print(f"{len(paths)} core paths, {n_iter} iterations")
+    print(f"{'engine':<10}{'s/sweep':>10}{'seed diff':>12}{'vs ' + engines[0]:>12}")
+    reference = None
+    for engine in engines:
+        prob, duration = _run(paths, engine, 1, n_iter, workers)
+        other, _ = _run(paths, engine, 2, n_iter, workers)
+        if reference is None:
+            reference = prob
+        print(
+            f"{engine:<10}{duration / n_iter:>10.4f}{np.abs(prob - other).mean():>12.4f}"
+            f"{np.abs(prob - reference).mean():>12.4f}"
+        )
+
+
+def estimator_report(corepathfile, iterations=(10, 20, 50, 100, 200), replicates=5, engine="chromatic", workers=1):
+    """Mean over links of the variance of each estimator's probabilities across
+    ``replicates`` seeds, for every number of sweeps in ``iterations``."""
+    paths = read_core_paths(corepathfile)
+    print(f"{len(paths)} core paths, {engine} engine, {replicates} seeds per cell")
+    print(f"{'sweeps':>8}" + "".join(f"{name:>16}" for name in GibbsSampling.ESTIMATORS) + f"{'ratio':>8}")
+    report = []
+    for n_iter in iterations:
+        row = {"iterations": n_iter}
+        for estimator in GibbsSampling.ESTIMATORS:
+            runs = np.stack(
+                [_run(paths, engine, seed, n_iter, workers, estimator)[0] for seed in range(1, replicates + 1)]
+            )
+            row[estimator] = float(runs.var(axis=0, ddof=1).mean())
+        report.append(row)
+        print(
+            f"{n_iter:>8}" + "".join(f"{row[name]:>16.3e}" for name in GibbsSampling.ESTIMATORS)
+            + (f"{row['counts'] / row['rao_blackwell']:>8.2f}" if row["rao_blackwell"] else f"{'-':>8}")
+        )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare speed and estimates of the Gibbs sampling engines")
+    parser.add_argument("--corepath_file", type=str, required=True, help="corepath.txt written by asrel_prob.py")
+    parser.add_argument("--gibbs_iter", type=int, default=100, help="Gibbs sampling iterations per run")
+    parser.add_argument("--engine", choices=GibbsSampling.ENGINES, action="append", help="Engines to run (default: all)")
+    parser.add_argument("--workers", type=int, default=1, help="Processes of the chromatic engine")
+    parser.add_argument("--estimators", action="store_true", help="Compare the variance of the counts and Rao-Blackwell estimators over iterations instead")
+    parser.add_argument("--iterations", type=int, nargs="+", default=[10, 20, 50, 100, 200], help="Sweeps compared by --estimators")
+    parser.add_argument("--replicates", type=int, default=5, help="Seeds per cell of --estimators")
+    parser.add_argument("--report_file", type=str, default=None, help="Also write the --estimators table as JSON")
+    args = parser.parse_args()
+    if args.estimators:
+        report = estimator_report(
+            args.corepath_file, args.iterations, args.replicates, (args.engine or ["chromatic"])[0], args.workers
+        )
+        if args.report_file:
+            with open(args.report_file, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=4)
+    else:
+        bench(args.corepath_file, args.gibbs_iter, tuple(args.engine or GibbsSampling.ENGINES), args.workers)
@@ -0,0 +1,70 @@
+import argparse
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import tempfile
+import time
+
+from compressed_io import zstandard
+from path_corpus import read_path_yield
+
+
+def _compress(src, dst_dir):
+    files = {"plain": src}
+    name = os.path.basename(src)
+    with open(src, "rb") as f:
+        data = f.read()
+    writers = {
+        "gzip": (".gz", lambda d: gzip.compress(d, compresslevel=6)),
+        "bz2": (".bz2", bz2.compress),
+        "xz": (".xz", lzma.compress),
+    }
+    if zstandard is not None:
+        writers["zstd"] = (".zst", lambda d: zstandard.ZstdCompressor(level=3).compress(d))
+    for codec, (suffix, compress) in writers.items():
+        dst = os.path.join(dst_dir, name + suffix)
+        with open(dst, "wb") as f:
+            f.write(compress(data))
+        files[codec] = dst
+    return files
+
+
+def _read_all(file):
+    paths, hops = 0, 0
+    for path, _ in read_path_yield(file):
+        paths += 1
+        hops += len(path)
+    return paths, hops
+
+
+def bench(pathfile, repeat=3):
+    size = os.path.getsize(pathfile)
+    tmp_dir = tempfile.mkdtemp(prefix="bench_path_io_")
+    try:
+        files = _compress(pathfile, tmp_dir)
+        print(f"{'codec':<8}{'on disk MB':>12}{'best s':>10}{'MB/s':>10}{'paths/s':>12}")
+        for codec, file in files.items():
+            best = None
+            for _ in range(repeat):
+                st = time.perf_counter()
+                paths, _ = _read_all(file)
+                duration = time.perf_counter() - st
+                best = duration if best is None else min(best, duration)
+            print(
+                f"{codec:<8}{os.path.getsize(file) / 1e6:>12.2f}{best:>10.3f}"
+                f"{size / 1e6 / best:>10.2f}{paths / best:>12.0f}"
+            )
+        if zstandard is None:
+            print("zstd skipped: zstandard is not installed")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare path reading throughput of compressed and plain inputs")
+    parser.add_argument("--path_file", type=str, required=True, help="Plain-text path|num file to benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per codec, the best one is reported")
+    args = parser.parse_args()
+    bench(args.path_file, args.repeat)
@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+import time
+
+
+def fingerprint(desc):
+    return hashlib.sha256(json.dumps(desc, sort_keys=True).encode()).hexdigest()
+
+
+class ComponentCache(object):
+    """On-disk store of solved ILP components that outlives a single run.
+
+    Each entry is <cache_dir>/<key[:2]>/<key>.json, keyed by a fingerprint of the
+    canonical sub-problem. Reading an entry refreshes its mtime; evict() drops
+    entries unused for more than max_age seconds, then the least recently used
+    ones until the cache fits in max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1 << 30, max_age=180 * 86400):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(path)
+        return entry
+
+    def put(self, key, entry):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_file = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_file, path)
+
+    def evict(self):
+        entries = []
+        for sub in os.listdir(self.cache_dir):
+            sub_dir = os.path.join(self.cache_dir, sub)
+            if not os.path.isdir(sub_dir):
+                continue
+            for name in os.listdir(sub_dir):
+                if name.endswith(".json"):
+                    stat = os.stat(os.path.join(sub_dir, name))
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(sub_dir, name)))
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes and now - mtime <= self.max_age:
+                break
+            os.remove(path)
+            total -= size
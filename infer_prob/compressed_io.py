@@ -0,0 +1,76 @@
+import bz2
+import gzip
+import io
+import lzma
+
+try:
+    import zstandard
+except ImportError:  # zstd input is optional
+    zstandard = None
+
+BUFFER_SIZE = 1 << 20
+
+_SUFFIXES = {
+    ".gz": "gzip",
+    ".bz2": "bz2",
+    ".xz": "xz",
+    ".lzma": "xz",
+    ".zst": "zstd",
+    ".zstd": "zstd",
+}
+_MAGIC = [
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+]
+
+
+def detect_compression(file):
+    for suffix, codec in _SUFFIXES.items():
+        if file.endswith(suffix):
+            return codec
+    with open(file, "rb") as f:
+        head = f.read(6)
+    for magic, codec in _MAGIC:
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def open_text(file, encoding="utf-8"):
+    """Open a plain, gzip, bz2, xz or zstd file for buffered text reading."""
+    codec = detect_compression(file)
+    if codec is None:
+        return open(file, "r", encoding=encoding, buffering=BUFFER_SIZE)
+    raw = open(file, "rb", buffering=BUFFER_SIZE)
+    try:
+        if codec == "gzip":
+            stream = gzip.GzipFile(fileobj=raw)
+        elif codec == "bz2":
+            stream = bz2.BZ2File(raw)
+        elif codec == "xz":
+            stream = lzma.LZMAFile(raw)
+        else:
+            if zstandard is None:
+                raise RuntimeError(
+                    f"{file} is zstd compressed, install the zstandard package to read it"
+                )
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, read_size=BUFFER_SIZE)
+        stream = io.BufferedReader(stream, buffer_size=BUFFER_SIZE)
+    except Exception:
+        raw.close()
+        raise
+    return _ClosingTextWrapper(stream, raw, encoding)
+
+
+class _ClosingTextWrapper(io.TextIOWrapper):
+    def __init__(self, stream, raw, encoding):
+        super().__init__(stream, encoding=encoding)
+        self._raw = raw
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._raw.close()
@@ -0,0 +1,79 @@
+import heapq
+import os
+import shutil
+import tempfile
+
+# rough per-entry cost of a {tuple of ints: int} dict item, plus 8 bytes per element
+ENTRY_OVERHEAD = 160
+# most runs merged at once, to stay well below open file limits
+MAX_FAN_IN = 128
+
+
+def _write_run(counts, run_file):
+    with open(run_file, "w", encoding="utf-8", newline="\n") as f:
+        for key in sorted(counts):
+            f.write("{} {}\n".format("|".join(map(str, key)), counts[key]))
+
+
+def _read_run(run_file):
+    with open(run_file, "r", encoding="utf-8") as f:
+        for line in f:
+            key, num = line.split(" ")
+            yield tuple(map(int, key.split("|"))), int(num)
+
+
+def _merge_runs(runs):
+    last, total = None, 0
+    for key, num in heapq.merge(*[_read_run(run) for run in runs]):
+        if key != last:
+            if last is not None:
+                yield last, total
+            last, total = key, 0
+        total += num
+    if last is not None:
+        yield last, total
+
+
+def aggregate_counts(items, memory_budget, spill_dir=None):
+    """Sum the counts of (tuple of ints, count) items and yield them in key order.
+
+    At most about ``memory_budget`` bytes of items are held at once: fuller maps are
+    sorted and spilled as runs to a temporary directory, which are then merged
+    k-way while streaming the result.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="spill_", dir=spill_dir)
+    try:
+        runs = []
+        counts, size = {}, 0
+        for key, num in items:
+            if key in counts:
+                counts[key] += num
+                continue
+            counts[key] = num
+            size += ENTRY_OVERHEAD + 8 * len(key)
+            if size >= memory_budget:
+                runs.append(os.path.join(tmp_dir, f"run_{len(runs)}.txt"))
+                _write_run(counts, runs[-1])
+                counts, size = {}, 0
+        if not runs:
+            for key in sorted(counts):
+                yield key, counts[key]
+            return
+        if counts:
+            runs.append(os.path.join(tmp_dir, f"run_{len(runs)}.txt"))
+            _write_run(counts, runs[-1])
+            counts = None
+        print(f"Merging {len(runs)} sorted runs...")
+        merged = 0
+        while len(runs) > MAX_FAN_IN:
+            run_file = os.path.join(tmp_dir, f"merged_{merged}.txt")
+            merged += 1
+            with open(run_file, "w", encoding="utf-8", newline="\n") as f:
+                for key, num in _merge_runs(runs[:MAX_FAN_IN]):
+                    f.write("{} {}\n".format("|".join(map(str, key)), num))
+            for run in runs[:MAX_FAN_IN]:
+                os.remove(run)
+            runs = runs[MAX_FAN_IN:] + [run_file]
+        yield from _merge_runs(runs)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -1,4 +1,11 @@
 from collections import defaultdict
+import hashlib
+import heapq
+import json
+import zipfile
+from multiprocessing import Barrier, Pool, Process
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
 import numpy as np
 from sortedcontainers import SortedDict
 import os
@@ -39,15 +46,447 @@ class ASGraph:
         return self.graph[link]
 
 
+# class of a context by the relationships of the links before and after it:
+# 0 p2c, 1 p2p, 2 c2p, at index 3 * last + next + 4
+CONTEXT_CLASS = [0, 1, 1, 0, 1, 1, 1, 2, 2]
+CONTEXT_CLASS_ARRAY = np.array(CONTEXT_CLASS, dtype=np.int64)
+# links with more contexts than this are counted with NumPy, the rest in Python
+NUMPY_CONTEXTS = 64
+
+
+class LinkContexts(object):
+    """Contexts of the links of an ASGraph as integer CSR arrays.
+
+    Link i is links[i] (as1 < as2) and its contexts are offsets[i]:offsets[i + 1].
+    A context refers to its neighbour links by slots of a signed relationship
+    array: slot 2 * j holds the relationship of link j and slot 2 * j + 1 its
+    negation, so that srel[lref] and srel[rref] are the relationships of the
+    links before and after as seen along the path. Slots 2 * n and 2 * n + 1 are
+    fixed to 1 and -1 and stand for a missing neighbour (c2p before, p2c after).
+    """
+
+    def __init__(self, graph):
+        self.links = sorted(graph)
+        self.index = {link: i for i, link in enumerate(self.links)}
+        n = len(self.links)
+        offsets, lref, rref, count = [0], [], [], []
+        for as1, as2 in self.links:
+            for (left, right), num in graph[(as1, as2)].items():
+                if left is None:
+                    lref.append(2 * n)
+                elif left < as1:
+                    lref.append(2 * self.index[(left, as1)])
+                else:
+                    lref.append(2 * self.index[(as1, left)] + 1)
+                if right is None:
+                    rref.append(2 * n + 1)
+                elif right > as2:
+                    rref.append(2 * self.index[(as2, right)])
+                else:
+                    rref.append(2 * self.index[(right, as2)] + 1)
+                count.append(num)
+            offsets.append(len(count))
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.lref = np.array(lref, dtype=np.int64)
+        self.rref = np.array(rref, dtype=np.int64)
+        self.count = np.array(count, dtype=np.int64)
+        # plain lists for the per-context loop over links with few contexts
+        self.offsets_list, self.lref_list, self.rref_list, self.count_list = offsets, lref, rref, count
+
+    def __len__(self):
+        return len(self.links)
+
+    def owners(self):
+        """Link of every context."""
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.offsets))
+
+    def adjacency(self):
+        """CSR (offsets, neighbours) of the links that appear in each other's contexts."""
+        n = len(self)
+        owner = np.concatenate([self.owners()] * 2)
+        neighbour = np.concatenate([self.lref, self.rref]) >> 1
+        keep = (neighbour < n) & (neighbour != owner)
+        # a neighbour in a context is adjacent in a path, so the relation is symmetric
+        pairs = np.unique(owner[keep] * n + neighbour[keep])
+        offsets = np.searchsorted(pairs // n, np.arange(n + 1))
+        return offsets, pairs % n
+
+    def colour(self):
+        """Greedy colouring, highest degree first, such that no two links of one
+        colour share a context; returns the colour of every link."""
+        offsets, neighbours = self.adjacency()
+        offsets, neighbours = offsets.tolist(), neighbours.tolist()
+        colours = [-1] * len(self)
+        for i in np.argsort(-np.diff(offsets), kind="stable").tolist():
+            used = {colours[j] for j in neighbours[offsets[i] : offsets[i + 1]]}
+            c = 0
+            while c in used:
+                c += 1
+            colours[i] = c
+        return np.array(colours, dtype=np.int64)
+
+    def colour_chunks(self, colours, parts):
+        """Per part, one (links, lref, rref, count, owner) chunk per colour: the
+        links of each colour split into ``parts`` runs of similar context counts,
+        with their contexts gathered and owner the position of their link."""
+        sizes = np.diff(self.offsets)
+        chunks = [[] for _ in range(parts)]
+        for c in range(int(colours.max()) + 1 if len(colours) else 0):
+            links = np.flatnonzero(colours == c)
+            bounds = np.searchsorted(
+                np.cumsum(sizes[links]), np.linspace(0, sizes[links].sum(), parts + 1)[1:-1], side="right"
+            )
+            for part, part_links in enumerate(np.split(links, bounds)):
+                part_sizes = sizes[part_links]
+                owner = np.repeat(np.arange(len(part_links), dtype=np.int64), part_sizes)
+                idx = (
+                    np.repeat(self.offsets[part_links], part_sizes)
+                    + np.arange(len(owner), dtype=np.int64)
+                    - np.repeat(np.cumsum(part_sizes) - part_sizes, part_sizes)
+                )
+                chunks[part].append((part_links, self.lref[idx], self.rref[idx], self.count[idx], owner))
+        return chunks
+
+
+def _draw(counts, uniforms):
+    """Relationships drawn by inverse CDF from rows of [p2c, p2p, c2p] counts."""
+    total = counts.sum(axis=1)
+    x = uniforms * total
+    rels = (x >= counts[:, 0]).astype(np.int8) + (x >= counts[:, 0] + counts[:, 1]) - 1
+    empty = total == 0
+    rels[empty] = (3 * uniforms[empty]).astype(np.int8) - 1
+    return rels
+
+
+def _conditionals(counts):
+    """Rows of [p2c, p2p, c2p] counts normalised to probabilities, uniform where empty."""
+    total = counts.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(total > 0, counts / total, 1 / 3)
+
+
+def _colour_sweeps(srel, counts, chunks, rng, burn_in, n_iter, barrier=None, probs=None):
+    """Chromatic sweeps over ``chunks`` (one per colour): every link of a colour
+    is resampled at once, then, with other processes, all wait at ``barrier``
+    before the next colour. Sampled states of the chunk links go to ``counts``,
+    and their conditional distributions are summed in ``probs`` if given."""
+    own = np.concatenate([chunk[0] for chunk in chunks]) if chunks else np.zeros(0, dtype=np.int64)
+    for it in range(burn_in + n_iter):
+        for links, lref, rref, count, owner in chunks:
+            if len(links):
+                classes = CONTEXT_CLASS_ARRAY[3 * srel[lref].astype(np.int64) + srel[rref] + 4]
+                class_counts = np.bincount(3 * owner + classes, weights=count, minlength=3 * len(links))
+                class_counts = class_counts.reshape(-1, 3)
+                if probs is not None and it >= burn_in:
+                    probs[links] += _conditionals(class_counts)
+                rels = _draw(class_counts, rng.random(len(links)))
+                srel[2 * links] = rels
+                srel[2 * links + 1] = -rels
+            if barrier is not None:
+                barrier.wait()
+        if it >= burn_in:
+            counts[own, srel[2 * own] + 1] += 1
+
+
+def _colour_worker(srel_name, counts_name, probs_name, n, chunks, seed, burn_in, n_iter, barrier):
+    srel_shm, counts_shm = SharedMemory(srel_name), SharedMemory(counts_name)
+    probs_shm = SharedMemory(probs_name) if probs_name else None
+    try:
+        srel = np.ndarray((2 * n + 2,), dtype=np.int8, buffer=srel_shm.buf)
+        counts = np.ndarray((n, 3), dtype=np.int64, buffer=counts_shm.buf)
+        probs = np.ndarray((n, 3), dtype=np.float64, buffer=probs_shm.buf) if probs_shm else None
+        _colour_sweeps(srel, counts, chunks, np.random.default_rng(seed), burn_in, n_iter, barrier, probs)
+    except BaseException:
+        barrier.abort()  # release the other workers instead of leaving them waiting
+        raise
+    finally:
+        srel = counts = probs = None
+        for shm in (srel_shm, counts_shm, probs_shm):
+            if shm is not None:
+                shm.close()
+
+
+def _join_workers(processes, barrier):
+    """Wait for the colour workers. A worker killed by a signal (e.g. by the OOM
+    killer) cannot abort the barrier itself, so once any worker fails the barrier
+    is aborted here and the others are terminated."""
+    running = {process.sentinel: process for process in processes}
+    while running:
+        for sentinel in wait(list(running)):
+            process = running.pop(sentinel)
+            process.join()
+            if process.exitcode != 0:
+                barrier.abort()
+                for other in running.values():
+                    other.terminate()
+                    other.join()
+                return
+
+
+# chain blocks report their state counts per sub-batch of this many sweeps (at most 127,
+# so that they fit int8); the ESS merges them into batches of about sqrt(n) sweeps
+SUB_BATCH = 10
+# fewer batch means than this do not estimate the ESS at all
+MIN_BATCHES = 20
+
+
+def _convergence(totals, history, lengths):
+    """Per-link R-hat and effective sample size of K chains, from their (K, links, 3)
+    state counts ``totals`` and the same counts per sub-batch of ``lengths[s]``
+    sweeps in ``history[s]``. Each state indicator is a Bernoulli series: R-hat
+    compares within- and between-chain variances, and the ESS estimates its
+    autocorrelation by batch means over consecutive sub-batches merged into
+    batches of about sqrt(n) sweeps; it is 0 until there are MIN_BATCHES of
+    them. A link takes its worst state; states that never or always occur
+    count as converged."""
+    n_iter = sum(lengths)
+    means = totals / n_iter
+    within = means * (1 - means)
+    w = within.mean(axis=0) * n_iter / max(n_iter - 1, 1)
+    b = n_iter * means.var(axis=0, ddof=1)
+    target = max(int(np.sqrt(n_iter)), 1)
+    bounds, length = [0], 0
+    for s, sub_length in enumerate(lengths):
+        length += sub_length
+        if length >= target:
+            bounds.append(s + 1)
+            length = 0
+    if length:  # a short last batch joins the one before it
+        bounds[-1] = len(lengths)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rhat = np.sqrt(((n_iter - 1) / n_iter * w + b / n_iter) / w)
+        rhat[w == 0] = np.where(b[w == 0] == 0, 1.0, np.inf)
+        if len(bounds) - 1 >= MIN_BATCHES:
+            batch_var = np.zeros_like(means)
+            for lo, hi in zip(bounds, bounds[1:]):
+                batch_length = sum(lengths[lo:hi])
+                batch_counts = np.sum(history[lo:hi], axis=0, dtype=np.int64)
+                batch_var += batch_length * (batch_counts / batch_length - means) ** 2
+            batch_var /= len(bounds) - 2
+            ess = np.where(batch_var > 0, np.minimum(n_iter * within / batch_var, n_iter), n_iter).sum(axis=0)
+        else:
+            ess = np.zeros_like(w)
+    pooled = totals.sum(axis=0)
+    ess[(pooled == 0) | (pooled == totals.shape[0] * n_iter)] = np.inf
+    return rhat.max(axis=1), ess.min(axis=1)
+
+
+def read_core_paths(corepathfile):
+    """{path: count} of a corepath.txt."""
+    paths = {}
+    with open(corepathfile, "r", encoding="utf-8") as f:
+        for line in f:
+            path, num = line.strip().split(" ")
+            paths[tuple(path.split("|"))] = int(num)
+    return paths
+
+
+def read_link_prob(clinkfile):
+    """{(as1, as2): [p2c, p2p, c2p]} of an as1|as2|p2c|p2p|c2p file such as core_link.txt."""
+    prob = {}
+    with open(clinkfile, "r", encoding="utf-8") as f:
+        for line in f:
+            as1, as2, p1, p2, p3 = line.strip().split("|")
+            prob[(as1, as2)] = [float(p1), float(p2), float(p3)]
+    return prob
+
+
+def _write_checkpoint(path, meta, arrays):
+    """Atomically replace ``path`` by an npz of ``arrays`` and the JSON ``meta``."""
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "wb") as f:
+            np.savez_compressed(f, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp_file, path)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def _remove_stale_tmp(path):
+    """Remove the temporary files left by writers of the checkpoint ``path``
+    that died mid-write."""
+    directory, name = os.path.split(path)
+    if not os.path.isdir(directory or "."):
+        return
+    for entry in os.listdir(directory or "."):
+        pid = entry[len(name) + 1:-len(".tmp")]
+        if not (entry.startswith(name + ".") and entry.endswith(".tmp") and pid.isdigit()):
+            continue
+        if int(pid) != os.getpid():
+            try:
+                os.kill(int(pid), 0)
+                continue  # still writing
+            except ProcessLookupError:
+                pass
+            except PermissionError:
+                continue
+        os.remove(os.path.join(directory, entry))
+
+
+def _read_checkpoint(path, meta_only=False):
+    """(meta, arrays) of a checkpoint, or (None, None) if it is missing or
+    unreadable; arrays is None with ``meta_only``."""
+    try:
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            arrays = None if meta_only else {name: data[name] for name in data.files if name != "meta"}
+        return meta, arrays
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None, None
+
+
+_CHAIN = None
+
+
+def _init_chain(sampler):
+    global _CHAIN
+    _CHAIN = sampler
+    _CHAIN.workers = 1  # pool workers cannot start processes of their own
+
+
+def _chain_block(task):
+    """Run one chain for ``burn_in`` + ``n_iter`` sweeps; returns its state and its
+    counts as an int8 (sub-batches, links, 3) array, see SUB_BATCH."""
+    srel, rng_state, schedule, burn_in, n_iter = task
+    _CHAIN.srel[:] = srel
+    _CHAIN._srel = srel.tolist()
+    _CHAIN.rng.bit_generator.state = rng_state
+    _CHAIN.schedule = schedule
+    _CHAIN.active_links = []
+    if burn_in:
+        _CHAIN._sample(burn_in, 0)
+    batches, probs = [], None
+    for start in range(0, n_iter, SUB_BATCH):
+        counts, batch_probs = _CHAIN._sample(0, min(SUB_BATCH, n_iter - start))
+        batches.append(counts.astype(np.int8))
+        if batch_probs is not None:
+            probs = batch_probs if probs is None else probs + batch_probs
+    return (
+        _CHAIN.srel, _CHAIN.rng.bit_generator.state, _CHAIN.schedule, np.stack(batches), probs, _CHAIN.active_links
+    )
+
+
 class GibbsSampling(object):
+    """Gibbs sampler of core-link relationships.
+
+    The "array" engine keeps the contexts as LinkContexts and the relationships
+    as an int8 array, and draws from a buffer of uniforms generated once per
+    sweep by a NumPy Generator seeded with ``seed``. The "chromatic" engine
+    colours the links so that links of one colour do not share a context and
+    resamples each colour at once, split across ``workers`` processes that
+    share the state. The "dict" engine is the original sampler over ASGraph and
+    the global NumPy random state.
+
+    With ``chains`` > 1, that many chains start from the initial relationships
+    in separate processes and are checked every ``check_every`` sweeps; they
+    stop once every link has an R-hat of at most ``rhat`` and an effective
+    sample size of at least ``min_ess``, or after n_iter sweeps. The effective
+    sample size needs at least MIN_BATCHES batches of about sqrt(n) sweeps, so
+    the chains never stop before that. Their counts are pooled, and
+    ``convergence`` reports the outcome.
+
+    The "counts" estimator turns the sampled states of every link into
+    [p2c, p2p, c2p] probabilities. The "rao_blackwell" estimator averages the
+    conditional distributions the states are drawn from instead, which has a
+    lower variance for the same sweeps (array and chromatic engines only).
 
-    def __init__(self, paths, init_asrel, burn_in=0) -> None:
+    With ``adaptive`` (array engine only), a link whose conditional has been
+    deterministic for ``patience`` consecutive sweeps, with no neighbour
+    changing meanwhile, is retired from the sweeps until a neighbour changes.
+    Its conditional stays the one-hot of its current state while retired, so
+    the estimates are those of full sweeps; ``active_links`` records how many
+    links every sweep resampled.
+
+    ``prior`` = (paths, prob) of an earlier run (array and chromatic engines)
+    starts every link it covers from its most likely relationship in ``prob``,
+    and resamples only the links whose contexts differ from those of ``paths``,
+    or that ``prob`` lacks, and the links within ``hops`` of them. The other
+    links keep their state and carry their probabilities forward;
+    ``incremental`` counts both kinds.
+
+    With ``checkpoint`` (array and chromatic engines), the state, counts and
+    random generator states are written to that file every ``checkpoint_every``
+    sweeps, or at every convergence check of several chains. A run with the same
+    contexts, settings and initial state resumes from it, from sweep
+    ``resumed_from``, and removes it once done. ``init_key`` describes how
+    ``init_asrel`` was obtained (any JSON value) and is part of that match.
+    """
+
+    ESTIMATORS = ("counts", "rao_blackwell")
+
+    ENGINES = ("array", "chromatic", "dict")
+
+    def __init__(
+        self, paths, init_asrel, burn_in=0, engine="array", seed=None, workers=1,
+        chains=1, rhat=1.05, min_ess=100, check_every=50, estimator="counts", adaptive=False, patience=10,
+        prior=None, hops=1, checkpoint=None, checkpoint_every=100, init_key=None,
+    ) -> None:
         # self.n_iter = n_iter
+        if engine not in self.ENGINES:
+            raise ValueError(f"unknown Gibbs sampling engine {engine!r}")
+        if estimator not in self.ESTIMATORS:
+            raise ValueError(f"unknown Gibbs estimator {estimator!r}")
+        if engine == "dict" and (chains > 1 or estimator != "counts"):
+            raise ValueError("multiple Gibbs chains and Rao-Blackwell estimates need the array or chromatic engine")
+        if prior is not None and engine == "dict":
+            raise ValueError("incremental Gibbs sampling needs the array or chromatic engine")
+        if checkpoint is not None and engine == "dict":
+            raise ValueError("Gibbs checkpoints need the array or chromatic engine")
+        if adaptive and engine != "array":
+            raise ValueError("adaptive Gibbs scheduling needs the array engine")
         self.burn_in = burn_in
+        self.engine = engine
+        self.seed = seed
+        self.workers = workers
+        self.chains = chains
+        self.rhat = rhat
+        self.min_ess = min_ess
+        self.check_every = check_every
+        self.estimator = estimator
+        self.patience = patience
+        self.convergence = None
+        self._chunks = None
+        self.schedule = None
+        self.active_links = []
+        self.incremental = None
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.resumed_from = 0
+        self.init_key = init_key
+        self._resample = None  # indices of the links sampled, None for all
+        self._carried = None
 
         self.graph = ASGraph()
         self.graph.load_from_paths(paths)
         self._init_asrel(init_asrel)
+        if engine != "dict":
+            self.contexts = LinkContexts(self.graph.get_graph())
+            self.rng = np.random.default_rng(seed)
+            self._init_srel()
+        if prior is not None:
+            self._init_prior(*prior, hops)
+        if engine != "dict":
+            self._init_digest = hashlib.sha256(self.srel.tobytes()).hexdigest()
+        if engine == "chromatic":
+            self.colours = self.contexts.colour()
+            if self._resample is not None:
+                self.colours[self._carried] = -1  # carried links are in no colour
+            self.colour_num = int(self.colours.max()) + 1 if len(self.colours) else 0
+        if adaptive:
+            n = len(self.contexts)
+            # per link: sweeps its conditional has been deterministic and whether it is retired
+            self.schedule = ([0] * n, [False] * n)
+            offsets, neighbours = self.contexts.adjacency()
+            if self._resample is not None:
+                # carried links stay retired, and are never woken
+                for i in np.flatnonzero(self._carried).tolist():
+                    self.schedule[1][i] = True
+                keep = ~self._carried[neighbours]
+                offsets = np.concatenate([[0], np.cumsum(keep)])[offsets]
+                neighbours = neighbours[keep]
+            self._neighbours = (offsets.tolist(), neighbours.tolist())
 
     def _init_asrel(self, init_asrel):
         self.asrel = SortedDict.fromkeys(self.graph.get_graph(), 0)
@@ -57,6 +496,373 @@ class GibbsSampling(object):
             elif as1 > as2 and (as2, as1) in self.asrel:
                 self.asrel[(as2, as1)] = -int(rel)
 
+    def _init_prior(self, prior_paths, prior_prob, hops):
+        old = ASGraph()
+        old.load_from_paths(prior_paths)
+        old_graph, graph = old.get_graph(), self.graph.get_graph()
+        links = self.contexts.links
+        changed = np.array(
+            [link not in prior_prob or link not in old_graph or graph[link] != old_graph[link] for link in links],
+            dtype=bool,
+        )
+        resample = changed.copy()
+        offsets, neighbours = self.contexts.adjacency()
+        frontier = np.flatnonzero(changed)
+        for _ in range(hops):
+            if len(frontier) == 0:
+                break
+            reached = np.concatenate([neighbours[offsets[i] : offsets[i + 1]] for i in frontier.tolist()])
+            frontier = np.unique(reached[~resample[reached]])
+            resample[frontier] = True
+        for i, link in enumerate(links):
+            if link in prior_prob:
+                self._set_rel(i, int(np.argmax(prior_prob[link])) - 1)
+        self._resample = np.flatnonzero(resample).tolist()
+        self._carried = ~resample
+        self._carried_prob = {links[i]: prior_prob[links[i]] for i in np.flatnonzero(self._carried).tolist()}
+        self.incremental = {
+            "hops": hops,
+            "changed_links": int(changed.sum()),
+            "resampled_links": len(self._resample),
+            "carried_links": len(self._carried_prob),
+        }
+
+    def __getstate__(self):
+        # chain processes sample from the context arrays only
+        state = self.__dict__.copy()
+        state["graph"] = None
+        state["asrel"] = None
+        return state
+
+    def _init_srel(self):
+        n = len(self.contexts)
+        self.srel = np.empty(2 * n + 2, dtype=np.int8)
+        self.srel[0 : 2 * n : 2] = [self.asrel[link] for link in self.contexts.links]
+        self.srel[1 : 2 * n : 2] = -self.srel[0 : 2 * n : 2]
+        self.srel[2 * n :] = [1, -1]
+        self._srel = self.srel.tolist()  # Python copy for links with few contexts
+
+    def rels(self):
+        """int8 relationships of contexts.links, a view of the sampler state."""
+        return self.srel[0 : 2 * len(self.contexts) : 2]
+
+    def _class_counts(self, i):
+        """[p2c, p2p, c2p] context counts of link i under the current state."""
+        ctx = self.contexts
+        start, stop = ctx.offsets_list[i], ctx.offsets_list[i + 1]
+        if stop - start > NUMPY_CONTEXTS:
+            classes = CONTEXT_CLASS_ARRAY[
+                3 * self.srel[ctx.lref[start:stop]].astype(np.int64) + self.srel[ctx.rref[start:stop]] + 4
+            ]
+            return np.bincount(classes, weights=ctx.count[start:stop], minlength=3).tolist()
+        srel, lref, rref, count = self._srel, ctx.lref_list, ctx.rref_list, ctx.count_list
+        counts = [0, 0, 0]
+        for k in range(start, stop):
+            counts[CONTEXT_CLASS[3 * srel[lref[k]] + srel[rref[k]] + 4]] += count[k]
+        return counts
+
+    def _set_rel(self, i, rel):
+        self.srel[2 * i] = rel
+        self.srel[2 * i + 1] = -rel
+        self._srel[2 * i] = rel
+        self._srel[2 * i + 1] = -rel
+
+    def _sweep(self, probs=None):
+        """One sequential sweep; adds the conditional [p2c, p2p, c2p] of link i to
+        probs[3 * i : 3 * i + 3] if ``probs`` (a flat list) is given."""
+        if self.schedule is not None:
+            return self._adaptive_sweep(probs)
+        uniforms = self.rng.random(len(self.contexts)).tolist()
+        for i in range(len(uniforms)) if self._resample is None else self._resample:
+            u = uniforms[i]
+            p2c, p2p, c2p = self._class_counts(i)
+            total = p2c + p2p + c2p
+            if total == 0:
+                rel = int(3 * u) - 1
+                p2c = p2p = c2p = 1  # uniform conditional
+                total = 3
+            else:
+                u *= total
+                rel = -1 if u < p2c else (0 if u < p2c + p2p else 1)
+            if probs is not None:
+                probs[3 * i] += p2c / total
+                probs[3 * i + 1] += p2p / total
+                probs[3 * i + 2] += c2p / total
+            if rel != self._srel[2 * i]:
+                self._set_rel(i, rel)
+
+    def _adaptive_sweep(self, probs=None):
+        """Sweep over the links that are not retired, in index order. A retired
+        link after the current one is resampled in this sweep once a neighbour
+        changes. ``probs`` gets the conditional minus the one-hot of the drawn
+        state of every resampled link, which is zero for the retired ones."""
+        stable, retired = self.schedule
+        offsets, neighbours = self._neighbours
+        srel, patience = self._srel, self.patience
+        uniforms = self.rng.random(len(self.contexts)).tolist()
+        queue = [i for i, r in enumerate(retired) if not r]  # sorted, hence a heap
+        active = 0
+        while queue:
+            i = heapq.heappop(queue)
+            active += 1
+            p2c, p2p, c2p = self._class_counts(i)
+            total = p2c + p2p + c2p
+            deterministic = total > 0 and max(p2c, p2p, c2p) == total
+            if total == 0:
+                rel = int(3 * uniforms[i]) - 1
+                p2c = p2p = c2p = 1  # uniform conditional
+                total = 3
+            else:
+                u = uniforms[i] * total
+                rel = -1 if u < p2c else (0 if u < p2c + p2p else 1)
+            if probs is not None:
+                probs[3 * i] += p2c / total
+                probs[3 * i + 1] += p2p / total
+                probs[3 * i + 2] += c2p / total
+                probs[3 * i + rel + 1] -= 1
+            if rel != srel[2 * i]:
+                self._set_rel(i, rel)
+                for j in neighbours[offsets[i] : offsets[i + 1]]:
+                    stable[j] = 0
+                    if retired[j]:
+                        retired[j] = False
+                        if j > i:
+                            heapq.heappush(queue, j)
+            if deterministic:
+                stable[i] += 1
+                retired[i] = stable[i] >= patience
+            else:
+                stable[i] = 0
+        self.active_links.append(active)
+
+    def _checkpoint_key(self, n_iter):
+        """Fingerprint of the contexts and of every setting the samples depend on."""
+        ctx = self.contexts
+        digest = hashlib.sha256("\n".join("|".join(link) for link in ctx.links).encode())
+        for array in (ctx.offsets, ctx.lref, ctx.rref, ctx.count):
+            digest.update(array.tobytes())
+        settings = [
+            self.engine, self.estimator, self.seed, self.burn_in, n_iter, self.chains, self.rhat, self.min_ess,
+            self.check_every, self.workers, None if self.schedule is None else self.patience, self._resample,
+            self._init_digest, self.init_key,
+        ]
+        digest.update(json.dumps(settings).encode())
+        return digest.hexdigest()
+
+    def _save_checkpoint(self, key, done, arrays, meta=None):
+        meta = dict(meta or {}, key=key, done=done, rng=self.rng.bit_generator.state)
+        arrays = dict(arrays, srel=self.srel, active_links=np.array(self.active_links, dtype=np.int64))
+        if self.schedule is not None:
+            arrays["stable"] = np.array(self.schedule[0], dtype=np.int64)
+            arrays["retired"] = np.array(self.schedule[1], dtype=bool)
+        _write_checkpoint(self.checkpoint, meta, {name: a for name, a in arrays.items() if a is not None})
+
+    def checkpoint_matches(self, n_iter):
+        """Whether the checkpoint file was written by a run of n_iter sweeps
+        on these contexts and settings, so that it will be resumed."""
+        if self.checkpoint is None:
+            return False
+        meta, _ = _read_checkpoint(self.checkpoint, meta_only=True)
+        return meta is not None and meta["key"] == self._checkpoint_key(n_iter)
+
+    def _load_checkpoint(self, key):
+        """Restore the sampler from a checkpoint written under ``key``; returns
+        its (meta, arrays), or None if there is none."""
+        _remove_stale_tmp(self.checkpoint)
+        meta, arrays = _read_checkpoint(self.checkpoint)
+        if meta is None or meta["key"] != key:
+            return None
+        self.srel[:] = arrays["srel"]
+        self._srel = self.srel.tolist()
+        self.rng.bit_generator.state = meta["rng"]
+        self.active_links = arrays["active_links"].tolist()
+        if self.schedule is not None:
+            self.schedule = (arrays["stable"].tolist(), arrays["retired"].tolist())
+        self.resumed_from = meta["done"]
+        return meta, arrays
+
+    def _checkpointed_sampling(self, burn_in, n_iter):
+        """_sample in blocks of checkpoint_every sweeps, checkpointed in between."""
+        n = len(self.contexts)
+        key = self._checkpoint_key(n_iter)
+        done = 0
+        counts = np.zeros((n, 3), dtype=np.int64)
+        probs = np.zeros((n, 3)) if self.estimator == "rao_blackwell" else None
+        restored = self._load_checkpoint(key)
+        if restored is not None:
+            done = restored[0]["done"]
+            counts = restored[1]["counts"]
+            probs = restored[1].get("probs")
+        while done < burn_in + n_iter:
+            block = min(self.checkpoint_every, burn_in + n_iter - done)
+            block_burn_in = min(block, max(burn_in - done, 0))
+            block_counts, block_probs = self._sample(block_burn_in, block - block_burn_in)
+            counts += block_counts
+            if probs is not None:
+                probs += block_probs
+            done += block
+            if done < burn_in + n_iter:
+                self._save_checkpoint(key, done, {"counts": counts, "probs": probs})
+        return counts, probs
+
+    def _sample(self, burn_in, n_iter):
+        """Run ``burn_in`` sweeps, then ``n_iter`` sweeps whose states are counted;
+        returns the (links, 3) [p2c, p2p, c2p] counts and, for the Rao-Blackwell
+        estimator, the sums of the conditional distributions (else None)."""
+        if self.engine == "chromatic":
+            return self._chromatic_sampling(burn_in, n_iter)
+        for _ in range(burn_in):
+            self._sweep()
+        n = len(self.contexts)
+        counts = np.zeros((n, 3), dtype=np.int64)
+        probs = [0.0] * (3 * n) if self.estimator == "rao_blackwell" else None
+        links = np.arange(n)
+        for _ in range(n_iter):
+            self._sweep(probs)
+            counts[links, self.rels() + 1] += 1
+        if probs is None:
+            return counts, None
+        probs = np.array(probs).reshape(n, 3)
+        if self.schedule is not None:
+            probs += counts  # the one-hots taken out by _adaptive_sweep
+        return counts, probs
+
+    def _array_sampling(self, n_iter):
+        """Per-link [p2c, p2p, c2p] state counts, or sums of conditional
+        distributions for the Rao-Blackwell estimator."""
+        if self.chains > 1:
+            counts, probs = self._multi_chain_sampling(n_iter)
+        elif self.checkpoint is not None:
+            counts, probs = self._checkpointed_sampling(self.burn_in, n_iter)
+        else:
+            counts, probs = self._sample(self.burn_in, n_iter)
+        if self.checkpoint is not None and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        for link, rel in zip(self.contexts.links, self.rels().tolist()):
+            self.asrel[link] = rel
+        return counts if probs is None else probs
+
+    def _multi_chain_sampling(self, max_iter):
+        n, chains = len(self.contexts), self.chains
+        states = [
+            (self.srel.copy(), np.random.default_rng(seed).bit_generator.state, self.schedule)
+            for seed in self.rng.integers(1 << 63, size=chains).tolist()
+        ]
+        totals = np.zeros((chains, n, 3), dtype=np.int64)
+        history, lengths = [], []  # (chains, links, 3) counts and sweeps of every sub-batch
+        probs = np.zeros((n, 3)) if self.estimator == "rao_blackwell" else None
+        done, burn_in = 0, self.burn_in
+        key = self._checkpoint_key(max_iter) if self.checkpoint is not None else None
+        restored = self._load_checkpoint(key) if key is not None else None
+        if restored is not None:
+            meta, arrays = restored
+            done, burn_in, lengths = meta["done"], 0, meta["lengths"]
+            schedules = [None] * chains
+            if self.schedule is not None:
+                schedules = [(s.tolist(), r.tolist()) for s, r in zip(arrays["chain_stable"], arrays["chain_retired"])]
+            states = list(zip(arrays["chain_srel"], meta["chain_rng"], schedules))
+            totals, history = arrays["totals"], list(arrays["history"])
+            probs = arrays.get("probs")
+        rhat, ess = np.full(n, np.nan), np.zeros(n)  # before any sweep
+        unconverged = n
+        with Pool(chains, initializer=_init_chain, initargs=(self,)) as pool:
+            while done < max_iter and unconverged != 0:
+                block = min(self.check_every, max_iter - done)
+                results = pool.map(
+                    _chain_block, [(srel, state, schedule, burn_in, block) for srel, state, schedule in states]
+                )
+                burn_in = 0
+                if self.schedule is not None:
+                    self.active_links.extend(np.sum([r[5] for r in results], axis=0).tolist())
+                for k, (srel, state, schedule, batches, chain_probs, _) in enumerate(results):
+                    states[k] = (srel, state, schedule)
+                    totals[k] += batches.sum(axis=0, dtype=np.int64)
+                    if probs is not None:
+                        probs += chain_probs
+                history.extend(np.stack([r[3] for r in results], axis=1))
+                lengths.extend(min(SUB_BATCH, block - start) for start in range(0, block, SUB_BATCH))
+                done += block
+                rhat, ess = _convergence(totals, history, lengths)
+                unconverged = int(np.count_nonzero((rhat > self.rhat) | (ess < self.min_ess)))
+                if key is not None and unconverged and done < max_iter:
+                    arrays = {
+                        "chain_srel": np.stack([state[0] for state in states]),
+                        "totals": totals, "history": np.stack(history), "probs": probs,
+                    }
+                    if self.schedule is not None:
+                        arrays["chain_stable"] = np.array([state[2][0] for state in states], dtype=np.int64)
+                        arrays["chain_retired"] = np.array([state[2][1] for state in states], dtype=bool)
+                    self._save_checkpoint(
+                        key, done, arrays, {"lengths": lengths, "chain_rng": [state[1] for state in states]}
+                    )
+        self.convergence = {
+            "chains": chains,
+            "iterations": done,
+            "converged": unconverged == 0,
+            "unconverged_links": unconverged,
+            # links on which the chains stay in different states have an infinite R-hat
+            "stuck_links": int(np.count_nonzero(np.isinf(rhat))),
+            "max_rhat": float(rhat[np.isfinite(rhat)].max()) if np.isfinite(rhat).any() else None,
+            "min_ess": float(ess[np.isfinite(ess)].min()) if np.isfinite(ess).any() else None,
+        }
+        self.srel[:] = states[0][0]
+        self._srel = self.srel.tolist()
+        self.schedule = states[0][2]
+        return totals.sum(axis=0), probs
+
+    def _chromatic_sampling(self, burn_in, n_iter):
+        n = len(self.contexts)
+        workers = max(1, min(self.workers, n))
+        if self._chunks is None or len(self._chunks) != workers:
+            self._chunks = self.contexts.colour_chunks(self.colours, workers)
+        chunks = self._chunks
+        rao_blackwell = self.estimator == "rao_blackwell"
+        if workers == 1:
+            counts = np.zeros((n, 3), dtype=np.int64)
+            probs = np.zeros((n, 3)) if rao_blackwell else None
+            _colour_sweeps(self.srel, counts, chunks[0], self.rng, burn_in, n_iter, probs=probs)
+            self._srel = self.srel.tolist()
+            return counts, probs
+        srel_shm = SharedMemory(create=True, size=self.srel.nbytes)
+        counts_shm = SharedMemory(create=True, size=max(n * 3 * 8, 1))
+        probs_shm = SharedMemory(create=True, size=max(n * 3 * 8, 1)) if rao_blackwell else None
+        try:
+            srel = np.ndarray(self.srel.shape, dtype=np.int8, buffer=srel_shm.buf)
+            counts = np.ndarray((n, 3), dtype=np.int64, buffer=counts_shm.buf)
+            probs = np.ndarray((n, 3), dtype=np.float64, buffer=probs_shm.buf) if rao_blackwell else None
+            srel[:] = self.srel
+            counts[:] = 0
+            if rao_blackwell:
+                probs[:] = 0
+            barrier = Barrier(workers)
+            seeds = self.rng.integers(1 << 63, size=workers).tolist()
+            processes = [
+                Process(
+                    target=_colour_worker,
+                    args=(
+                        srel_shm.name, counts_shm.name, probs_shm.name if rao_blackwell else None,
+                        n, chunks[k], seeds[k], burn_in, n_iter, barrier,
+                    ),
+                )
+                for k in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            _join_workers(processes, barrier)
+            if any(process.exitcode != 0 for process in processes):
+                raise RuntimeError("a chromatic Gibbs sampling worker failed")
+            self.srel[:] = srel
+            counts = counts.copy()
+            probs = probs.copy() if rao_blackwell else None
+            del srel
+        finally:
+            for shm in (srel_shm, counts_shm, probs_shm):
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+        self._srel = self.srel.tolist()
+        return counts, probs
+
     def _cal_conditional_prob(self, link):
         as1, as2 = link
         p2c_count, p2p_count, c2p_count = 0, 0, 0
@@ -94,6 +900,12 @@ class GibbsSampling(object):
         return [p2c_count / count_sum, p2p_count / count_sum, c2p_count / count_sum]
 
     def gibbs_sampling(self, n_iter):
+        if self.engine != "dict":
+            counts = self._array_sampling(n_iter)
+            asrel_count = SortedDict(zip(self.contexts.links, counts.tolist()))
+            if self._carried is not None:
+                asrel_count.update(self._carried_prob)
+            return asrel_count
         # burn in
         for _ in range(1, self.burn_in + 1):
             for link in self.graph.get_graph():
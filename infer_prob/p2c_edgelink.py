@@ -36,9 +36,15 @@ class P2C_Topology(object):
 
 
 class P2CEdgeLinkInfer(object):
-    def __init__(self, pathnumfile, clinks):
-        self.clinks = clinks
-        self.pathnumfile = pathnumfile
+    def __init__(self, corpus, clinks):
+        self.corpus = corpus
+        # core link probabilities keyed by corpus ids
+        asn2id = corpus.asn_ids()
+        self.clinks = {
+            (asn2id[as1], asn2id[as2]): prob
+            for (as1, as2), prob in clinks.items()
+            if as1 in asn2id and as2 in asn2id
+        }
         self.p2c_topo = P2C_Topology()
         self.p2c_set = SortedSet()
 
@@ -47,20 +53,8 @@ class P2CEdgeLinkInfer(object):
         # self.right_paths=SortedDict()
         # self.middle_paths=SortedDict()
 
-    def read_path_yield(self):  # path:tuple num:int
-        files = self.pathnumfile if isinstance(self.pathnumfile, list) else [self.pathnumfile]
-        for file in files:
-            with open(file, "r", encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip().split(" ")
-                    if len(line) == 1:
-                        yield tuple(line[0].split("|")), 1
-                    else:
-                        p, n = line
-                        yield tuple(p.split("|")), int(n)
-
     def _fold_path(self, th):
-        for path, num in self.read_path_yield():
+        for path, num in self.corpus.iter_paths():
             left = -1  
             right = len(path) - 1  
             for i in range(len(path) - 1):
@@ -169,5 +163,10 @@ class P2CEdgeLinkInfer(object):
                 reserved_paths[path[left : right + 1]] = (
                     reserved_paths.get(path[left : right + 1], 0) + num
                 )
-                
-        return self.p2c_set, reserved_paths
+
+        to_asns = self.corpus.to_asns
+        p2c_set = SortedSet(to_asns(link) for link in self.p2c_set)
+        reserved_paths = SortedDict(
+            (to_asns(path), num) for path, num in reserved_paths.items()
+        )
+        return p2c_set, reserved_paths
@@ -0,0 +1,249 @@
+from array import array
+from multiprocessing import Pool
+import json
+import os
+import numpy as np
+from compressed_io import open_text
+
+
+def read_path_yield(pathnumfile):  # path:tuple num:int
+    files = pathnumfile if isinstance(pathnumfile, list) else [pathnumfile]
+    for file in files:
+        with open_text(file) as f:
+            for line in f:
+                line = line.strip().split(" ")
+                if len(line) == 1:
+                    yield tuple(line[0].split("|")), 1
+                else:
+                    p, n = line
+                    yield tuple(p.split("|")), int(n)
+
+
+def _ingest_file(file):
+    """Parse one path file into a deduplicated {path: num} map plus the link
+    adjacencies (a|b next to b|c) it contains, as (a, b, c) triples.
+
+    A triple and its reverse describe the same adjacency and are stored once,
+    except around a prepended self-link (a == b or b == c), whose two ends can
+    only be told apart by the direction of the path.
+    """
+    paths = {}
+    triples = set()
+    for path, num in read_path_yield(file):
+        key = "|".join(path)
+        paths[key] = paths.get(key, 0) + num
+        for i in range(1, len(path) - 1):
+            a, b, c = path[i - 1 : i + 2]
+            if a > c and a != b and b != c:
+                a, c = c, a
+            triples.add((a, b, c))
+    return paths, triples
+
+
+class PathCorpus(object):
+    """CSR path corpus: path k is nodes[offsets[k]:offsets[k+1]] seen counts[k] times.
+
+    ASN ids follow the string order of the ASNs, so comparing two ids (or two id
+    tuples) gives the same result as comparing the original strings.
+    """
+
+    ASNS = "asns.txt"
+    NODES = "nodes.npy"
+    OFFSETS = "offsets.npy"
+    COUNTS = "counts.npy"
+    TRIPLES = "triples.npy"
+    SOURCES = "sources.json"
+
+    def __init__(self, asns, nodes, offsets, counts, triples=None):
+        self.asns = asns
+        self.nodes = nodes
+        self.offsets = offsets
+        self.counts = counts
+        # optional (n, 3) array of link adjacencies a-b-c, precomputed by sharded ingestion
+        self.triples = triples
+
+    def __len__(self):
+        return len(self.counts)
+
+    @classmethod
+    def files(cls, corpus_dir, sharded=False):
+        names = [cls.ASNS, cls.NODES, cls.OFFSETS, cls.COUNTS] + ([cls.TRIPLES] if sharded else [])
+        return [os.path.join(corpus_dir, name) for name in names]
+
+    @staticmethod
+    def exists(corpus_dir):
+        return all(
+            os.path.exists(os.path.join(corpus_dir, name))
+            for name in (PathCorpus.ASNS, PathCorpus.NODES, PathCorpus.OFFSETS, PathCorpus.COUNTS)
+        )
+
+    @classmethod
+    def _source_stats(cls, pathnumfile):
+        files = pathnumfile if isinstance(pathnumfile, list) else [pathnumfile]
+        stats = []
+        for file in sorted(os.path.abspath(file) for file in files):
+            stat = os.stat(file)
+            stats.append([file, stat.st_size, stat.st_mtime_ns])
+        return stats
+
+    @classmethod
+    def write_sources(cls, corpus_dir, pathnumfile):
+        """Record path, size and mtime of the path files the corpus was compiled from."""
+        with open(os.path.join(corpus_dir, cls.SOURCES), "w", encoding="utf-8") as f:
+            json.dump(cls._source_stats(pathnumfile), f)
+
+    @classmethod
+    def is_current(cls, corpus_dir, pathnumfile):
+        """Whether corpus_dir holds a corpus compiled from the path files as they are now."""
+        if not cls.exists(corpus_dir):
+            return False
+        try:
+            with open(os.path.join(corpus_dir, cls.SOURCES), "r", encoding="utf-8") as f:
+                return json.load(f) == cls._source_stats(pathnumfile)
+        except (OSError, ValueError):
+            return False
+
+    @classmethod
+    def _intern(cls, paths):
+        asn2id = {}
+        nodes, offsets, counts = array("i"), array("q", [0]), array("q")
+        for path, num in paths:
+            for asn in path:
+                idx = asn2id.get(asn)
+                if idx is None:
+                    idx = asn2id[asn] = len(asn2id)
+                nodes.append(idx)
+            offsets.append(len(nodes))
+            counts.append(num)
+        # renumber ids so that id order matches ASN string order
+        asns = sorted(asn2id)
+        remap = np.empty(len(asns), dtype=np.int32)
+        for new_id, asn in enumerate(asns):
+            remap[asn2id[asn]] = new_id
+        nodes = remap[np.frombuffer(nodes, dtype=np.int32)] if len(nodes) else np.empty(0, dtype=np.int32)
+        return cls(
+            asns,
+            nodes,
+            np.frombuffer(offsets, dtype=np.int64).copy(),
+            np.frombuffer(counts, dtype=np.int64).copy(),
+        )
+
+    @classmethod
+    def compile(cls, pathnumfile, corpus_dir, workers=1):
+        if workers > 1:
+            corpus = cls._ingest_sharded(pathnumfile, workers)
+        else:
+            corpus = cls._intern(read_path_yield(pathnumfile))
+        corpus.save(corpus_dir)
+        cls.write_sources(corpus_dir, pathnumfile)
+        return cls.load(corpus_dir)
+
+    @classmethod
+    def _ingest_sharded(cls, pathnumfile, workers):
+        files = pathnumfile if isinstance(pathnumfile, list) else [pathnumfile]
+        paths = {}
+        triples = set()
+        with Pool(min(workers, max(len(files), 1))) as pool:
+            for part_paths, part_triples in pool.imap(_ingest_file, files):
+                for key, num in part_paths.items():
+                    paths[key] = paths.get(key, 0) + num
+                triples |= part_triples
+        corpus = cls._intern((tuple(key.split("|")), num) for key, num in paths.items())
+        asn2id = corpus.asn_ids()
+        corpus.triples = np.array(
+            sorted((asn2id[a], asn2id[b], asn2id[c]) for a, b, c in triples),
+            dtype=np.int32,
+        ).reshape(-1, 3)
+        return corpus
+
+    @classmethod
+    def from_paths(cls, paths, asns=None):
+        """Build an in-memory corpus from a {path: num} mapping.
+
+        Without ``asns`` the paths hold ASN strings and are interned; with it they
+        already hold ids into ``asns``.
+        """
+        if asns is None:
+            return cls._intern(paths.items())
+        nodes, offsets, counts = array("i"), array("q", [0]), array("q")
+        for path, num in paths.items():
+            nodes.extend(path)
+            offsets.append(len(nodes))
+            counts.append(num)
+        return cls(
+            asns,
+            np.frombuffer(nodes, dtype=np.int32).copy(),
+            np.frombuffer(offsets, dtype=np.int64).copy(),
+            np.frombuffer(counts, dtype=np.int64).copy(),
+        )
+
+    @classmethod
+    def from_file(cls, pathnumfile):
+        """Build an in-memory corpus straight from path files, without a {path: num} dict."""
+        return cls._intern(read_path_yield(pathnumfile))
+
+    def save(self, corpus_dir):
+        os.makedirs(corpus_dir, exist_ok=True)
+        with open(os.path.join(corpus_dir, self.ASNS), "w", encoding="utf-8", newline="\n") as f:
+            for asn in self.asns:
+                f.write(asn + "\n")
+        np.save(os.path.join(corpus_dir, self.NODES), np.asarray(self.nodes, dtype=np.int32))
+        np.save(os.path.join(corpus_dir, self.OFFSETS), np.asarray(self.offsets, dtype=np.int64))
+        np.save(os.path.join(corpus_dir, self.COUNTS), np.asarray(self.counts, dtype=np.int64))
+        triples_file = os.path.join(corpus_dir, self.TRIPLES)
+        if self.triples is not None:
+            np.save(triples_file, np.asarray(self.triples, dtype=np.int32))
+        elif os.path.exists(triples_file):
+            os.remove(triples_file)
+
+    @classmethod
+    def load(cls, corpus_dir):
+        with open(os.path.join(corpus_dir, cls.ASNS), "r", encoding="utf-8") as f:
+            asns = [line.rstrip("\n") for line in f]
+        triples_file = os.path.join(corpus_dir, cls.TRIPLES)
+        return cls(
+            asns,
+            np.load(os.path.join(corpus_dir, cls.NODES), mmap_mode="r"),
+            np.load(os.path.join(corpus_dir, cls.OFFSETS), mmap_mode="r"),
+            np.load(os.path.join(corpus_dir, cls.COUNTS), mmap_mode="r"),
+            np.load(triples_file, mmap_mode="r") if os.path.exists(triples_file) else None,
+        )
+
+    def iter_paths(self, chunk=1 << 16):  # path:tuple of ids num:int
+        for start in range(0, len(self.counts), chunk):
+            stop = min(start + chunk, len(self.counts))
+            offsets = self.offsets[start : stop + 1].tolist()
+            base = offsets[0]
+            nodes = self.nodes[base : offsets[-1]].tolist()
+            counts = self.counts[start:stop].tolist()
+            for k in range(stop - start):
+                yield tuple(nodes[offsets[k] - base : offsets[k + 1] - base]), counts[k]
+
+    def items(self):  # path:tuple of ASNs num:int, so that a corpus can stand in for {path: num}
+        asns = self.asns
+        for path, num in self.iter_paths():
+            yield tuple(asns[i] for i in path), num
+
+    def iter_triples(self):  # (a, b, c): link a-b is next to link b-c on some path
+        if self.triples is not None:
+            for a, b, c in self.triples.tolist():
+                yield a, b, c
+            return
+        for path, _ in self.iter_paths():
+            for i in range(1, len(path) - 1):
+                yield path[i - 1], path[i], path[i + 1]
+
+    def triple_array(self):
+        if self.triples is not None:
+            return np.asarray(self.triples, dtype=np.int64).reshape(-1, 3)
+        buf = array("i")
+        for a, b, c in self.iter_triples():
+            buf.extend((a, b, c))
+        return np.frombuffer(buf, dtype=np.int32).astype(np.int64).reshape(-1, 3)
+
+    def to_asns(self, path):
+        asns = self.asns
+        return tuple(asns[i] for i in path)
+
+    def asn_ids(self):
+        return {asn: i for i, asn in enumerate(self.asns)}
@@ -0,0 +1,69 @@
+from path_corpus import PathCorpus
+
+# (first, last) ranges of private, reserved and documentation ASNs (RFC 6996, 7300, 5398, 6793)
+BOGON_ASN_RANGES = [
+    (0, 0),
+    (23456, 23456),
+    (64496, 131071),
+    (4200000000, 4294967295),
+]
+
+
+def is_bogon_asn(asn):
+    try:
+        asn = int(asn)
+    except ValueError:  # AS sets and other non-numeric hops
+        return True
+    return any(first <= asn <= last for first, last in BOGON_ASN_RANGES)
+
+
+def sanitize_corpus(corpus):
+    """Collapse prepending, drop looped paths and paths with bogon ASNs, and
+    merge the counts of paths that become identical.
+
+    Returns the cleaned in-memory corpus (sharing the ASN table of ``corpus``)
+    and a report of what was removed.
+    """
+    bogon = [is_bogon_asn(asn) for asn in corpus.asns]
+    report = {
+        "paths_in": 0,
+        "paths_out": 0,
+        "prepended_paths": 0,
+        "looped_paths": 0,
+        "bogon_paths": 0,
+        "merged_paths": 0,
+        "links_in": 0,
+        "links_out": 0,
+    }
+    links_in, links_out = set(), set()
+    clean = {}
+    for path, num in corpus.iter_paths():
+        report["paths_in"] += 1
+        for i in range(len(path) - 1):
+            a, b = path[i], path[i + 1]
+            links_in.add((a, b) if a < b else (b, a))
+        if any(bogon[asn] for asn in path):
+            report["bogon_paths"] += 1
+            continue
+        collapsed = [path[0]]
+        for asn in path[1:]:
+            if asn != collapsed[-1]:
+                collapsed.append(asn)
+        if len(collapsed) != len(path):
+            report["prepended_paths"] += 1
+        if len(set(collapsed)) != len(collapsed):
+            report["looped_paths"] += 1
+            continue
+        collapsed = tuple(collapsed)
+        if collapsed in clean:
+            report["merged_paths"] += 1
+            clean[collapsed] += num
+        else:
+            clean[collapsed] = num
+            for i in range(len(collapsed) - 1):
+                a, b = collapsed[i], collapsed[i + 1]
+                links_out.add((a, b) if a < b else (b, a))
+    report["paths_out"] = len(clean)
+    report["links_in"] = len(links_in)
+    report["links_out"] = len(links_out)
+    return PathCorpus.from_paths(clean, corpus.asns), report
@@ -0,0 +1,106 @@
+"""Binary form of the pathprob.txt link probability table.
+
+Layout (little endian): the 8-byte magic ``PPROBTB1``, a uint64 row count n,
+n sorted uint64 keys ``as1 << 32 | as2`` with as1 < as2, then n rows of float32
+``p2c, p2p, c2p`` for the link as1 -> as2. The file is memory-mapped on load and
+only needs the standard library, so it can also be read under PyPy.
+"""
+from array import array
+from bisect import bisect_left
+import mmap
+import os
+import struct
+import sys
+
+MAGIC = b"PPROBTB1"
+HEADER = struct.Struct("<8sQ")
+
+
+def binary_path(text_file):
+    return os.path.splitext(text_file)[0] + ".bin"
+
+
+def find_prob_table(text_file):
+    """Return the binary table next to ``text_file`` if it is at least as new."""
+    bin_file = binary_path(text_file)
+    if not os.path.exists(bin_file):
+        return None
+    if os.path.exists(text_file) and os.path.getmtime(bin_file) < os.path.getmtime(text_file):
+        return None
+    return bin_file
+
+
+def write_prob_table(text_file, bin_file=None):
+    """Convert a as1|as2|p2c|p2p|c2p file; later lines win like in the text loaders.
+
+    Returns the number of rows written, or None when an ASN is not a 32-bit number.
+    """
+    bin_file = bin_file or binary_path(text_file)
+    table = {}
+    with open(text_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            as1, as2, p2c, p2p, c2p = line.strip().split("|")
+            try:
+                as1, as2 = int(as1), int(as2)
+            except ValueError:
+                return None
+            if not (0 <= as1 < 1 << 32 and 0 <= as2 < 1 << 32):
+                return None
+            if as1 <= as2:
+                table[(as1 << 32) | as2] = (float(p2c), float(p2p), float(c2p))
+            else:
+                table[(as2 << 32) | as1] = (float(c2p), float(p2p), float(p2c))
+    keys = array("Q", sorted(table))
+    probs = array("f")
+    for key in keys:
+        probs.extend(table[key])
+    if sys.byteorder == "big":
+        keys.byteswap()
+        probs.byteswap()
+    tmp_file = bin_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(keys)))
+        keys.tofile(f)
+        probs.tofile(f)
+    os.replace(tmp_file, bin_file)
+    return len(keys)
+
+
+class ProbTable(object):
+    def __init__(self, bin_file):
+        with open(bin_file, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{bin_file} is not a probability table")
+        view = memoryview(self._mm)
+        start = HEADER.size
+        if sys.byteorder == "big":
+            self.keys, self.probs = array("Q"), array("f")
+            self.keys.frombytes(view[start : start + 8 * n])
+            self.probs.frombytes(view[start + 8 * n : start + 20 * n])
+            self.keys.byteswap()
+            self.probs.byteswap()
+        else:
+            self.keys = view[start : start + 8 * n].cast("Q")
+            self.probs = view[start + 8 * n : start + 20 * n].cast("f")
+
+    def __len__(self):
+        return len(self.keys)
+
+    def rows(self):  # as1, as2, p2c, p2p, c2p with as1 < as2
+        keys, probs = self.keys.tolist(), self.probs.tolist()
+        for i, key in enumerate(keys):
+            yield key >> 32, key & 0xFFFFFFFF, probs[3 * i], probs[3 * i + 1], probs[3 * i + 2]
+
+    def get(self, as1, as2, default=None):
+        """[p2c, p2p, c2p] of the link as1 -> as2."""
+        lo, hi = (as1, as2) if as1 <= as2 else (as2, as1)
+        key = (lo << 32) | hi
+        i = bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return default
+        p2c, p2p, c2p = self.probs[3 * i : 3 * i + 3]
+        return [p2c, p2p, c2p] if as1 <= as2 else [c2p, p2p, p2c]
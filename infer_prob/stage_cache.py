@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+CHUNK_SIZE = 1 << 20
+
+
+def _digest_file(file):
+    h = hashlib.sha256()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def code_version():
+    """Hash of the inference sources, so that cached stages expire with code changes."""
+    h = hashlib.sha256()
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(src_dir)):
+        if name.endswith(".py") and not name.startswith("bench_"):
+            h.update(name.encode())
+            with open(os.path.join(src_dir, name), "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+class StageCache(object):
+    """Content-addressed store of pipeline stage outputs.
+
+    An entry is keyed on the stage name, the keys of the stages it was computed
+    from, content hashes of its input files, its parameters and the code version.
+    Entries live in <cache_dir>/<key>/ and are described by manifest.json; the
+    least recently used ones are evicted once the cache grows beyond max_bytes.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, cache_dir, max_bytes=10 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.version = code_version()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.manifest = {"entries": {}, "file_hashes": {}}
+        manifest_file = os.path.join(cache_dir, self.MANIFEST)
+        if os.path.exists(manifest_file):
+            with open(manifest_file, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        self._prune_file_hashes()
+
+    def _prune_file_hashes(self):
+        # forget hashes of files that were removed or have changed since they were hashed
+        file_hashes = self.manifest["file_hashes"]
+        for path, known in list(file_hashes.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del file_hashes[path]
+                continue
+            if known["size"] != stat.st_size or known["mtime_ns"] != stat.st_mtime_ns:
+                del file_hashes[path]
+
+    def _write_manifest(self):
+        manifest_file = os.path.join(self.cache_dir, self.MANIFEST)
+        tmp_file = manifest_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_file, manifest_file)
+
+    def file_hash(self, file):
+        # content hashes are remembered per (path, size, mtime) to avoid rehashing big inputs
+        stat = os.stat(file)
+        path = os.path.abspath(file)
+        known = self.manifest["file_hashes"].get(path)
+        if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+            return known["sha256"]
+        digest = _digest_file(file)
+        self.manifest["file_hashes"][path] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": digest,
+        }
+        return digest
+
+    def key(self, stage, upstream=(), input_files=(), params=None):
+        desc = {
+            "stage": stage,
+            "version": self.version,
+            "upstream": list(upstream),
+            "inputs": sorted(self.file_hash(file) for file in input_files),
+            "params": params or {},
+        }
+        return hashlib.sha256(json.dumps(desc, sort_keys=True).encode()).hexdigest()
+
+    def fetch(self, key, files):
+        """Copy the entry's files to ``files`` (matched by basename); False on a miss."""
+        entry = self.manifest["entries"].get(key)
+        entry_dir = os.path.join(self.cache_dir, key)
+        if entry is None or not all(
+            os.path.basename(file) in entry["files"] for file in files
+        ):
+            return False
+        if not all(os.path.isfile(os.path.join(entry_dir, name)) for name in entry["files"]):
+            # files were removed from the cache directory behind our back
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            del self.manifest["entries"][key]
+            self._write_manifest()
+            return False
+        for file in files:
+            os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+            shutil.copyfile(os.path.join(entry_dir, os.path.basename(file)), file)
+        entry["last_used"] = time.time()
+        self._write_manifest()
+        return True
+
+    def store(self, key, stage, files):
+        entry_dir = os.path.join(self.cache_dir, key)
+        tmp_dir = entry_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        size = 0
+        for file in files:
+            shutil.copyfile(file, os.path.join(tmp_dir, os.path.basename(file)))
+            size += os.path.getsize(file)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+        now = time.time()
+        self.manifest["entries"][key] = {
+            "stage": stage,
+            "files": [os.path.basename(file) for file in files],
+            "size": size,
+            "created": now,
+            "last_used": now,
+        }
+        self._evict(keep=key)
+        self._write_manifest()
+
+    def _evict(self, keep=None):
+        entries = self.manifest["entries"]
+        total = sum(entry["size"] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= entries[key]["size"]
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            del entries[key]
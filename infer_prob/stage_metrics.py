@@ -0,0 +1,76 @@
+from contextlib import contextmanager
+import json
+import os
+import resource
+import time
+import tracemalloc
+
+
+def _reset_peak_rss():
+    # Linux >= 4.0 resets VmHWM when "5" is written to clear_refs
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageMetrics(object):
+    """Wall/CPU time, peak RSS, optional tracemalloc peak and sizes of each stage."""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.start = time.perf_counter()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        record = {"stage": name}
+        per_stage_rss = _reset_peak_rss()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_s"] = time.perf_counter() - wall
+            record["cpu_s"] = time.process_time() - cpu
+            record["peak_rss_mb"] = _peak_rss_mb()
+            if not per_stage_rss:
+                record["peak_rss_is_process_peak"] = True
+            record["children_peak_rss_mb"] = (
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+            )
+            if self.trace_memory:
+                record["tracemalloc_peak_mb"] = tracemalloc.get_traced_memory()[1] / (1 << 20)
+            self.stages.append(record)
+            print(
+                "[{}] wall {:.2f}s cpu {:.2f}s peak rss {:.1f} MB".format(
+                    name, record["wall_s"], record["cpu_s"], record["peak_rss_mb"]
+                )
+            )
+
+    def write(self, metrics_file):
+        out = {
+            "total_wall_s": time.perf_counter() - self.start,
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "stages": self.stages,
+        }
+        tmp_file = metrics_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(out, f, indent=4)
+        os.replace(tmp_file, metrics_file)
@@ -1,6 +1,7 @@
 from dataclasses import dataclass, field
 from typing import Set, Dict, Tuple, Optional, Any
 from frozendict import frozendict
+from infer_prob.prob_table import ProbTable, find_prob_table
 import os
 
 
@@ -19,7 +20,13 @@ class PathProbData:
     def load_asrel_prob_from_file(cls, file_path: str) -> "PathProbData":
         asrel_prob: Dict[Tuple[int, int], Tuple[float, float, float]] = {}
         try:
-            if "pathprob" in file_path:
+            # binary table written by infer_prob/asrel_prob.py next to pathprob.txt
+            bin_path = find_prob_table(file_path) if "pathprob" in file_path else None
+            if bin_path:
+                for as1, as2, p1, p2, p3 in ProbTable(bin_path).rows():
+                    asrel_prob[(as1, as2)] = (p1, p2, p3)
+                    asrel_prob[(as2, as1)] = (p3, p2, p1)
+            elif "pathprob" in file_path:
                 with open(file_path, "r") as f:
                     for line in f:
                         line = line.strip()
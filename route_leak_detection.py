@@ -3,6 +3,8 @@ import os
 import numpy as np
 import json
 import time
+from infer_prob.compressed_io import open_text
+from infer_prob.prob_table import ProbTable, find_prob_table
 
 ROUTE_LEAK_DIR='test_data/leak_detection/cloudflare_data'
 ASREL_DIR="test_data/prob_inference/result/202506/"  # Directory containing AS relationship files
@@ -33,6 +35,16 @@ def _read_asrel(asrelfile):  # if as1<as2, then asrel[(as1,as2)]=rel
     return asrel
 
 def _read_prob(probfile):
+    bin_file = find_prob_table(probfile)
+    if bin_file:
+        prob = {}
+        for as1, as2, p2c, p2p, c2p in ProbTable(bin_file).rows():
+            as1, as2 = str(as1), str(as2)
+            if as1 <= as2:
+                prob[(as1, as2)] = [p2c, p2p, c2p]
+            else:
+                prob[(as2, as1)] = [c2p, p2p, p2c]
+        return SortedDict(prob)
     prob = SortedDict()  # [p2c,p2p,c2p]
     with open(probfile) as f:
         for line in f:
@@ -48,7 +60,7 @@ def _read_prob(probfile):
 def _read_path(pathfiles):
     files = pathfiles if isinstance(pathfiles, list) else [pathfiles]
     for file in files:
-        with open(file, "r") as f:
+        with open_text(file) as f:
             for line in f:
                 line = line.strip().split(" ")
                 yield line[0].split("|"), int(line[1]) if len(line) == 2 else 1